@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""Benchmarks for `github_canvas_grader` against the local mock server.
+
+Run with ``python -m pytest benchmarks``. Every
+benchmark is repeated for 50, 500 and 5000 simulated student repos so that
+scaling regressions show up as a change in slope between the sizes.
+"""
+
+import glob
+import json
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from canvasapi import Canvas
+from ghapi.all import GhApi
+
+from github_canvas_grader import github_canvas_grader as grader
+
+from github_canvas_grader.mock_server import MockData, MockServer
+
+SIZES = [50, 500, 5000]
+
+ASSIGNMENT = 'hw1'
+
+TEMPLATES = dict()
+for path in glob.glob(os.path.join(os.path.dirname(__file__), 'fixtures', '*.json')):
+    with open(path) as f:
+        TEMPLATES[os.path.splitext(os.path.basename(path))[0]] = json.load(f)
+
+DUE_ARGS = {'--due': True, '<DATE>': '2023-02-03', '<TIME>': '23:59:59',
+            '<TIME_ZONE>': 'CST', '<MULTIPLIER>': '1.1'}
+
+
+@pytest.fixture(scope='module', params=SIZES, ids=lambda n: f'{n}repos')
+def mock(request):
+    """A mock server simulating a class of the parametrized size."""
+    data = MockData(request.param, [ASSIGNMENT], templates=TEMPLATES)
+    # Rate limits are lifted so that only the grader's own work is timed
+    with MockServer(data, github_rate_limit=10 ** 9, canvas_bucket=10.0 ** 9) as server:
+        yield data, server
+
+
+@pytest.fixture
+def gh_api(mock):
+    data, server = mock
+    return GhApi(owner=data.org, token='mock', gh_host=server.url)
+
+
+@pytest.fixture
+def course(mock):
+    data, server = mock
+    return Canvas(server.url, 'mock').get_course(data.course_id)
+
+
+def test_filter_repos(benchmark, mock, gh_api):
+    data, _ = mock
+    repos = benchmark(grader.filter_repos, gh_api, data.org, ASSIGNMENT)
+    assert len(repos) == len(data.repos)
+
+
+def test_get_latest_workflow_run(benchmark, mock, gh_api):
+    data, _ = mock
+    run = benchmark(grader.get_latest_workflow_run, gh_api, data.repos[-1])
+    assert run['id'] == data.runs[data.repos[-1]]['id']
+
+
+def test_fetch_latest_workflow_runs(benchmark, mock, gh_api):
+    data, _ = mock
+    runs = benchmark.pedantic(grader.fetch_latest_workflow_runs,
+                              args=(gh_api, data.repos), rounds=1, iterations=1)
+    assert len(runs) == len(data.repos)
+
+
+def test_read_username_map(benchmark, mock, tmp_path, monkeypatch):
+    data, _ = mock
+    data.username_map_csv(tmp_path / 'username_map.csv')
+    monkeypatch.chdir(tmp_path)
+    username_map = benchmark(grader.read_username_map)
+    assert len(username_map) == len(data.usernames)
+
+
+def test_score_multiplier(benchmark, mock):
+    data, _ = mock
+    commit_time = data.runs[data.repos[0]]['head_commit']['timestamp']
+
+    def score_all():
+        return [grader.score_multiplier(DUE_ARGS, commit_time) for _ in data.repos]
+
+    multipliers = benchmark(score_all)
+    assert multipliers[0] == 1.1
+
+
+def test_score_runs(benchmark, mock, tmp_path, monkeypatch):
+    data, _ = mock
+    data.username_map_csv(tmp_path / 'username_map.csv')
+    monkeypatch.chdir(tmp_path)
+    username_map = grader.read_username_map()
+    frame = grader.runs_to_frame(data.runs)
+
+    scored = benchmark(grader.score_runs, frame, username_map,
+                       grader.DuePolicy.from_args(DUE_ARGS))
+    assert scored['score'].notna().all()
+
+
+def test_late_policy(benchmark, mock):
+    data, _ = mock
+    frame = grader.score_runs(grader.runs_to_frame(data.runs),
+                              pd.DataFrame({'Github Username': data.usernames, 'EID': data.eids}
+                                           ).set_index('Github Username'))
+    due = pd.Timestamp('2023-02-03 23:59:59', tz='America/Chicago')
+    policy = grader.LatePolicy([(due - pd.Timedelta(days=2), 1.1), (due, 1.0)],
+                               daily_penalty=0.1, floor=0.5, cutoff_days=7, grace=900.0,
+                               extensions=pd.Series(86400.0, index=data.eids[::10]))
+
+    multipliers = benchmark(policy, frame['commit_timestamp'], eids=frame['eid'])
+    assert len(multipliers) == len(data.repos)
+
+
+def test_grading_loop(benchmark, mock, gh_api, course, tmp_path, monkeypatch):
+    data, _ = mock
+    data.username_map_csv(tmp_path / 'username_map.csv')
+    monkeypatch.chdir(tmp_path)
+
+    def grade():
+        repos = grader.discover_repos(gh_api, data.org, ASSIGNMENT)
+        runs = grader.fetch_latest_workflow_runs(gh_api, repos)
+        username_map = grader.read_username_map()
+        assignment = grader.AssignmentResolver(course).get_assignment(ASSIGNMENT)
+        roster = grader.RosterCache(course)
+        return grader.grade_runs(runs, ASSIGNMENT, username_map, roster, assignment,
+                                 multiplier=grader.DuePolicy.from_args(DUE_ARGS),
+                                 bulk=True, verbose=False)
+
+    result = benchmark.pedantic(grade, rounds=1, iterations=1)
+    assert result['failures'] == {}
+    assert len(result['grades']) == len(data.repos)
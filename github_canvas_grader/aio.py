@@ -0,0 +1,446 @@
+"""The aio module contains an asyncio-native version of the grading pipeline.
+
+All Github and Canvas requests are made with ``httpx.AsyncClient`` instances
+that pool and keep alive their connections, so the stages of the pipeline
+(discovering repos, fetching workflow runs, resolving users and uploading
+grades) can overlap their network round trips.
+"""
+
+import asyncio
+import os
+import time
+
+import httpx
+
+from .github_canvas_grader import (as_username_map, partition_repos, runs_to_frame,
+                                   score_runs)
+
+GITHUB_API = os.environ.get('GH_HOST', 'https://api.github.com')
+
+
+def _retry_delay(response, attempt: int, backoff: float=1.0):
+    """
+    Return the number of seconds to wait before retrying a throttled response.
+
+    Parameters
+    ----------
+    response : httpx.Response
+        The response to a request.
+    attempt : int
+        The number of attempts made so far.
+    backoff : float, optional
+        Initial backoff in seconds, by default 1.0.
+
+    Returns
+    -------
+    float
+        The retry delay in seconds.
+    None
+        If the response was not throttled.
+    """
+    if response.status_code not in (403, 429):
+        return None
+
+    if 'Retry-After' in response.headers:
+        return float(response.headers['Retry-After'])
+
+    if response.headers.get('X-RateLimit-Remaining') == '0':
+        reset = float(response.headers.get('X-RateLimit-Reset', 0))
+        return max(reset - time.time(), 0.0)
+
+    if response.status_code == 429 or 'rate limit' in response.text.lower():
+        return backoff * 2 ** attempt
+
+    return None
+
+
+async def request(client, method: str, url: str, retries: int=5, **kwargs):
+    """
+    Make a request, retrying it while it is throttled.
+
+    Parameters
+    ----------
+    client : httpx.AsyncClient
+        The client to make the request with.
+    method : str
+        The HTTP method.
+    url : str
+        The URL, absolute or relative to the client's base URL.
+    retries : int, optional
+        Maximum number of retries of a throttled request, by default 5.
+    **kwargs
+        Keyword arguments of ``httpx.AsyncClient.request``.
+
+    Returns
+    -------
+    httpx.Response
+        The successful response.
+
+    Raises
+    ------
+    httpx.HTTPStatusError
+        If the final response is an error.
+    """
+    for attempt in range(retries + 1):
+        response = await client.request(method, url, **kwargs)
+        delay = _retry_delay(response, attempt)
+        if delay is None or attempt == retries:
+            break
+        await asyncio.sleep(delay)
+
+    response.raise_for_status()
+    return response
+
+
+async def paginate(client, url: str, params: dict=None):
+    """
+    Retrieve every item of a paginated list endpoint by following its ``Link`` headers.
+
+    Parameters
+    ----------
+    client : httpx.AsyncClient
+        The client to make the requests with.
+    url : str
+        The URL of the first page.
+    params : dict, optional
+        Query parameters of the first page.
+
+    Returns
+    -------
+    list
+        The items of all pages.
+    """
+    items = list()
+    while url is not None:
+        response = await request(client, 'GET', url, params=params)
+        items.extend(response.json())
+        url = response.links.get('next', {}).get('url')
+        params = None
+
+    return items
+
+
+async def discover_repos(github, org: str, filter_string: str, backend: str='list'):
+    """
+    Retrieve the repositories of an organization that match a given filter string.
+
+    By default the full organization listing is filtered. The opt-in
+    ``'search'`` backend tries Github's repository search first, which may
+    miss newly created repositories; the listing is only used if the search
+    is incomplete or finds nothing.
+
+    Parameters
+    ----------
+    github : httpx.AsyncClient
+        The Github client.
+    org : str
+        The organization name.
+    filter_string : str
+        The string to filter the repository names by.
+    backend : str, optional
+        Either ``'list'`` or ``'search'``, by default 'list'.
+
+    Returns
+    -------
+    list
+        A list of repository names that match the filter string.
+    """
+    repos = list()
+    page = 1
+    while backend == 'search':
+        response = await request(github, 'GET', '/search/repositories',
+                                 params={'q': f'{filter_string} org:{org} in:name',
+                                         'per_page': 100, 'page': page})
+        results = response.json()
+        if results['incomplete_results'] or results['total_count'] > 1000:
+            repos = list()
+            break
+        repos.extend(item['name'] for item in results['items']
+                     if filter_string in item['name'])
+        if not results['items'] or page * 100 >= results['total_count']:
+            break
+        page += 1
+
+    if repos:
+        return repos
+
+    items = await paginate(github, f'/orgs/{org}/repos', {'per_page': 100})
+    return [item['name'] for item in items if filter_string in item['name']]
+
+
+async def fetch_latest_workflow_runs(github, org: str, repos: list,
+                                     workflow_filename: str='main.yml',
+                                     concurrency: int=16):
+    """
+    Concurrently get the latest workflow run for many repositories.
+
+    Parameters
+    ----------
+    github : httpx.AsyncClient
+        The Github client.
+    org : str
+        The organization name.
+    repos : list
+        The repository names.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    concurrency : int, optional
+        The maximum number of requests in flight (default is 16).
+
+    Returns
+    -------
+    dict
+        A mapping of repository names to workflow runs in the same order as
+        `repos`. Repositories without runs or whose lookup failed map to None.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(repo):
+        async with semaphore:
+            try:
+                response = await request(
+                    github, 'GET',
+                    f'/repos/{org}/{repo}/actions/workflows/{workflow_filename}/runs',
+                    params={'per_page': 1})
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404:
+                    print(f"Failed to fetch workflow runs for {repo}: {e}")
+                return None
+        runs = response.json()['workflow_runs']
+        return runs[0] if runs else None
+
+    runs = await asyncio.gather(*(fetch(repo) for repo in repos))
+    return dict(zip(repos, runs))
+
+
+async def fetch_roster(canvas, course_id):
+    """
+    Map the lowercase EIDs of a course's students to their Canvas user ids.
+
+    Parameters
+    ----------
+    canvas : httpx.AsyncClient
+        The Canvas client.
+    course_id : int or str
+        The Canvas course id.
+
+    Returns
+    -------
+    dict
+        A mapping of lowercase EIDs to Canvas user ids.
+    """
+    enrollments = await paginate(canvas, f'courses/{course_id}/enrollments',
+                                 {'type[]': 'StudentEnrollment', 'per_page': 100})
+
+    return {str(enrollment['user']['login_id']).lower(): enrollment['user_id']
+            for enrollment in enrollments
+            if enrollment.get('user', {}).get('login_id')}
+
+
+async def get_assignment_id(canvas, course_id, assignment_name: str):
+    """
+    Retrieve the id of a course's assignment by name.
+
+    Parameters
+    ----------
+    canvas : httpx.AsyncClient
+        The Canvas client.
+    course_id : int or str
+        The Canvas course id.
+    assignment_name : str
+        The name of the assignment.
+
+    Returns
+    -------
+    int
+        The id of the assignment with the given name.
+        None if no assignment with the given name is found.
+    """
+    assignments = await paginate(canvas, f'courses/{course_id}/assignments',
+                                 {'search_term': assignment_name, 'per_page': 100})
+
+    for assignment in assignments:
+        if assignment['name'] == assignment_name:
+            return assignment['id']
+
+    print(f"No assignment id with corresponding name: {assignment_name}")
+    return
+
+
+async def upload_grades_in_bulk(canvas, course_id, assignment_id, grades: dict,
+                                batch_size: int=100, poll_interval: float=1.0,
+                                timeout: float=300.0):
+    """
+    Upload grades for many students with Canvas bulk update_grades calls.
+
+    Batches are posted concurrently. A batch whose Canvas job fails is split
+    in half and retried until the failure is isolated to individual students.
+    If the request itself fails, every student of the batch is reported as
+    failed without splitting it, and authentication errors are raised.
+
+    Parameters
+    ----------
+    canvas : httpx.AsyncClient
+        The Canvas client.
+    course_id : int or str
+        The Canvas course id.
+    assignment_id : int
+        The Canvas assignment id.
+    grades : dict
+        A mapping of Canvas user ids to scores.
+    batch_size : int, optional
+        Number of students per bulk update call, by default 100.
+    poll_interval : float, optional
+        Seconds to wait between Progress polls, by default 1.0.
+    timeout : float, optional
+        Maximum number of seconds to wait on each job, by default 300.0.
+
+    Returns
+    -------
+    dict
+        A mapping of Canvas user ids to error messages for every student
+        whose grade could not be posted.
+
+    Raises
+    ------
+    httpx.HTTPStatusError
+        If Canvas rejects the token.
+    """
+    failures = dict()
+    url = f'courses/{course_id}/assignments/{assignment_id}/submissions/update_grades'
+
+    async def wait(progress):
+        deadline = time.monotonic() + timeout
+        while progress['workflow_state'] not in ('completed', 'failed'):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Canvas job {progress['id']} did not finish "
+                                   f"within {timeout} seconds")
+            await asyncio.sleep(poll_interval)
+            response = await request(canvas, 'GET', f"progress/{progress['id']}")
+            progress = response.json()
+        return progress
+
+    async def post(batch):
+        try:
+            response = await request(
+                canvas, 'POST', url,
+                data={f'grade_data[{canvas_id}][posted_grade]': str(score)
+                      for canvas_id, score in batch})
+            progress = await wait(response.json())
+        except (httpx.HTTPError, TimeoutError) as e:
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code in (401, 403):
+                raise
+            # Splitting cannot isolate a failure that is not about the grades
+            failures.update((canvas_id, str(e)) for canvas_id, _ in batch)
+            return
+
+        if progress['workflow_state'] == 'completed':
+            return
+        message = progress.get('message') or 'Canvas job failed'
+        if len(batch) == 1:
+            failures[batch[0][0]] = message
+        else:
+            middle = len(batch) // 2
+            await asyncio.gather(post(batch[:middle]), post(batch[middle:]))
+
+    items = list(grades.items())
+    await asyncio.gather(*(post(items[start:start + batch_size])
+                           for start in range(0, len(items), batch_size)))
+
+    return failures
+
+
+async def grade_assignment(assignment_name: str, username_map, *, org: str,
+                           github_token: str, canvas_url: str, canvas_token: str,
+                           course_id, workflow_filename: str='main.yml',
+                           multiplier=None, concurrency: int=16, transport=None):
+    """
+    Grade an assignment from its Github Actions results and upload the grades to Canvas.
+
+    Discovering the repos, reading the course roster and resolving the
+    assignment run concurrently; the workflow runs of all repos are then
+    fetched concurrently, scored together with `score_runs` and every grade
+    is posted with bulk update_grades calls.
+
+    Parameters
+    ----------
+    assignment_name : str
+        Name of the assignment, used both to filter repos and to find the
+        Canvas assignment.
+    username_map : UsernameMap
+        Map of lowercase Github usernames to EIDs, see `read_username_map`.
+    org : str
+        The Github organization name.
+    github_token : str
+        The Github token.
+    canvas_url : str
+        The base URL of the Canvas instance, e.g. 'https://utexas.instructure.com'.
+    canvas_token : str
+        The Canvas token.
+    course_id : int or str
+        The Canvas course id.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    multiplier : callable, optional
+        Function mapping a Series of commit times to score multipliers, e.g.
+        a `DuePolicy` or `LatePolicy`, see `score_runs`. By default always 1.0.
+    concurrency : int, optional
+        The maximum number of Github requests in flight (default is 16).
+    transport : httpx.AsyncBaseTransport, optional
+        Transport used by both clients instead of the network, e.g. for testing.
+
+    Returns
+    -------
+    dict
+        ``grades`` maps Canvas user ids to the uploaded scores, ``failures``
+        maps Canvas user ids to upload errors and ``skipped`` maps repository
+        names to the reason they were not graded.
+    """
+    import pandas as pd
+
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    github = httpx.AsyncClient(base_url=GITHUB_API, limits=limits, transport=transport,
+                               headers={'Accept': 'application/vnd.github.v3+json',
+                                        'Authorization': f'token {github_token}'})
+    canvas = httpx.AsyncClient(base_url=f'{canvas_url}/api/v1/', limits=limits,
+                               transport=transport,
+                               headers={'Authorization': f'Bearer {canvas_token}'})
+
+    username_map = as_username_map(username_map)
+
+    async with github, canvas:
+        repos, roster, assignment_id = await asyncio.gather(
+            discover_repos(github, org, assignment_name),
+            fetch_roster(canvas, course_id),
+            get_assignment_id(canvas, course_id, assignment_name))
+        # Substring matches of hw1 also find hw10 repos
+        repos = partition_repos(repos, [assignment_name])[assignment_name]
+
+        runs = await fetch_latest_workflow_runs(github, org, repos, workflow_filename,
+                                                concurrency)
+
+        grades = dict()
+        skipped = dict()
+        scored = score_runs(runs_to_frame(runs), username_map, multiplier)
+        for row in scored.itertuples(index=False):
+            if pd.isna(row.score):
+                conclusion = None if pd.isna(row.conclusion) else row.conclusion
+                skipped[row.repo] = f'workflow conclusion is {conclusion}'
+                continue
+            if pd.isna(row.eid):
+                skipped[row.repo] = f'no EID for {row.github_username}'
+                continue
+            if row.eid not in roster:
+                skipped[row.repo] = f'{row.eid} is not enrolled in the course'
+                continue
+
+            grades[roster[row.eid]] = row.score
+
+        if assignment_id is None:
+            failures = {canvas_id: f'No assignment named {assignment_name}'
+                        for canvas_id in grades}
+        else:
+            failures = await upload_grades_in_bulk(canvas, course_id, assignment_id, grades)
+
+    return {'grades': grades, 'failures': failures, 'skipped': skipped}
@@ -1,19 +1,319 @@
 """Console script for github_canvas_grader."""
 import argparse
+import json
+import os
 import sys
+import time
+from datetime import datetime, timezone
 
+from . import __version__
+from . import github_canvas_grader as grader
+from . import webhook
 
-def main():
-    """Console script for github_canvas_grader."""
-    parser = argparse.ArgumentParser()
-    parser.add_argument('_', nargs='*')
-    args = parser.parse_args()
 
-    print("Arguments: " + str(args._))
-    print("Replace this message by putting your code into "
-          "github_canvas_grader.cli.main")
+def _add_common_arguments(parser):
+    parser.add_argument('-e', '--env', nargs=2, action='append', default=[],
+                        metavar=('NAME', 'VALUE'), help='set an environment variable')
+    parser.add_argument('--org', help='Github organization '
+                                      '(default: the owner of GITHUB_REPOSITORY)')
+    parser.add_argument('--workflow', default='main.yml',
+                        help='workflow filename (default: %(default)s)')
+    parser.add_argument('--cache-dir', help='directory of the repo, roster, assignment, '
+                                            'username map and grade caches '
+                                            '(default: GRADER_CACHE_DIR)')
+    parser.add_argument('--no-cache', action='store_true', help='disable all caches')
+    parser.add_argument('-m', '--metrics', action='store_true',
+                        help='print the time spent in each phase and API endpoint')
+    parser.add_argument('--metrics-file', help='write the time spent in each phase and '
+                                               'API endpoint as JSON')
+
+
+def _add_workers_argument(parser):
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='number of concurrent requests (default: %(default)s)')
+
+
+def _add_discovery_argument(parser):
+    parser.add_argument('--discovery', choices=('list', 'search'), default='list',
+                        help='find repos by listing the organization or with the '
+                             'search API, which may miss new repos (default: %(default)s)')
+
+
+def _add_grading_arguments(parser):
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='upload grades even if they are unchanged since the last run')
+    penalty = parser.add_mutually_exclusive_group()
+    penalty.add_argument('-d', '--due', nargs=4,
+                         metavar=('DATE', 'TIME', 'TIME_ZONE', 'MULTIPLIER'),
+                         help='multiply the scores of submissions committed by the due date')
+    penalty.add_argument('-l', '--late-policy', metavar='FILE',
+                         help='score late submissions with a JSON tiered late-penalty policy')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print failures')
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(
+        prog='github_canvas_grader',
+        description='Grade Github Actions results and upload the grades to Canvas.')
+    parser.add_argument('--version', action='version',
+                        version=f'%(prog)s {__version__}')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    grade = subparsers.add_parser('grade', help='grade one or more assignments')
+    grade.add_argument('assignments', nargs='+', metavar='assignment',
+                       help="assignment name or glob pattern, e.g. 'hw*'")
+    _add_common_arguments(grade)
+    _add_workers_argument(grade)
+    _add_discovery_argument(grade)
+    grade.add_argument('-b', '--bulk', action='store_true',
+                       help='upload all grades with Canvas bulk update_grades calls')
+    grade.add_argument('--batch-size', type=int, default=100,
+                       help='students per bulk update call (default: %(default)s)')
+    grade.add_argument('-g', '--graphql', action='store_true',
+                       help='fetch workflow results with batched GraphQL queries')
+    _add_grading_arguments(grade)
+
+    trigger = subparsers.add_parser('trigger', help="re-run the assignment's workflows")
+    trigger.add_argument('assignment', help='assignment name')
+    _add_common_arguments(trigger)
+    _add_workers_argument(trigger)
+    _add_discovery_argument(trigger)
+
+    serve = subparsers.add_parser(
+        'serve', help='grade repos as their workflow_run webhooks are delivered')
+    serve.add_argument('assignments', nargs='*', metavar='assignment',
+                       help='assignment name or glob pattern to grade (default: all)')
+    _add_common_arguments(serve)
+    serve.add_argument('--host', default='127.0.0.1',
+                       help='address to listen on (default: %(default)s)')
+    serve.add_argument('-p', '--port', type=int, default=8080,
+                       help='port to listen on (default: %(default)s)')
+    _add_grading_arguments(serve)
+
+    replay = subparsers.add_parser(
+        'replay', help='post a signed webhook delivery to a grader server')
+    replay.add_argument('url', help='URL of the grader server')
+    replay.add_argument('-e', '--env', nargs=2, action='append', default=[],
+                        metavar=('NAME', 'VALUE'), help='set an environment variable')
+    source = replay.add_mutually_exclusive_group(required=True)
+    source.add_argument('--payload', metavar='FILE',
+                        help='JSON payload of the delivery, e.g. copied from Github')
+    source.add_argument('--repo', help='send a completed workflow_run event of this repo')
+    replay.add_argument('--org', help='Github organization '
+                                      '(default: the owner of GITHUB_REPOSITORY)')
+    replay.add_argument('--event', default='workflow_run',
+                        help='X-GitHub-Event header (default: %(default)s)')
+    replay.add_argument('--workflow', default='main.yml',
+                        help='workflow filename (default: %(default)s)')
+    replay.add_argument('--run-id', type=int, help='workflow run id (default: the time)')
+    replay.add_argument('--conclusion', default='success',
+                        help='workflow run conclusion (default: %(default)s)')
+    replay.add_argument('--commit-time',
+                        help='ISO 8601 commit timestamp (default: now)')
+
+    encode = subparsers.add_parser('encode', help='encode a Google client secret file')
+    encode.add_argument('secret', help='Google client secret JSON file')
+
+    status = subparsers.add_parser('status', help='show the grades recorded in the cache')
+    status.add_argument('assignment', nargs='?', help='assignment name')
+    status.add_argument('--cache-dir', help='cache directory (default: GRADER_CACHE_DIR)')
+
+    benchmark = subparsers.add_parser(
+        'benchmark', help='benchmark a trigger against a recorded fixture without calling Github')
+    benchmark.add_argument('assignment', help='assignment name')
+    benchmark.add_argument('fixture', help='fixture recorded with replay.record_fixture')
+    benchmark.add_argument('--workflow', default='main.yml',
+                           help='workflow filename (default: %(default)s)')
+    benchmark.add_argument('-w', '--workers', type=int, default=8,
+                           help='number of concurrent requests (default: %(default)s)')
+    benchmark.add_argument('--latency-scale', type=float, default=1.0,
+                           help='factor applied to the recorded latencies (default: %(default)s)')
+
+    return parser
+
+
+def _require_env(parser, name):
+    value = os.environ.get(name)
+    if not value:
+        parser.error(f'the {name} environment variable is not set')
+    return value
+
+
+def _configure(parser, args):
+    for name, value in args.env:
+        os.environ[name] = value
+    if args.no_cache:
+        os.environ.pop('GRADER_CACHE_DIR', None)
+    elif args.cache_dir:
+        os.environ['GRADER_CACHE_DIR'] = args.cache_dir
+    if args.org is None:
+        args.org = _require_env(parser, 'GITHUB_REPOSITORY').split('/')[0]
+
+
+def _report_metrics(args, metrics):
+    if args.metrics:
+        metrics.print_summary()
+    if args.metrics_file:
+        metrics.write_json(args.metrics_file)
+
+
+def _multiplier(args):
+    if args.late_policy:
+        return grader.LatePolicy.from_file(args.late_policy)
+    if args.due:
+        date, time_, time_zone, multiplier = args.due
+        return grader.DuePolicy.from_args({'--due': True, '<DATE>': date,
+                                           '<TIME>': time_, '<TIME_ZONE>': time_zone,
+                                           '<MULTIPLIER>': multiplier})
+    return None
+
+
+def grade(parser, args):
+    """Grade one or more assignments and upload the grades to Canvas."""
+    _configure(parser, args)
+
+    multiplier = _multiplier(args)
+    metrics = grader.Metrics()
+    results = grader.grade_assignments(
+        args.assignments, org=args.org,
+        github_token=_require_env(parser, 'GH_TOKEN'),
+        canvas_url=os.environ.get('CANVAS_URL', 'https://utexas.instructure.com'),
+        canvas_token=_require_env(parser, 'CANVAS_TOKEN'),
+        course_id=_require_env(parser, 'CANVAS_COURSE_ID'),
+        google_creditials=os.environ.get('GOOGLE_CLIENT_SECRET'),
+        workflow_filename=args.workflow, multiplier=multiplier, workers=args.workers,
+        graphql=args.graphql, bulk=args.bulk, batch_size=args.batch_size,
+        force=args.force, discovery=args.discovery, metrics=metrics,
+        verbose=not args.quiet)
+
+    for assignment, result in results.items():
+        print(f"{assignment}: graded {len(result['grades'])} of {len(result['repos'])} repos, "
+              f"{len(result['failures'])} failed")
+    _report_metrics(args, metrics)
+    return 1 if any(result['failures'] for result in results.values()) else 0
+
+
+def trigger(parser, args):
+    """Re-run the latest workflow of every repo of an assignment."""
+    _configure(parser, args)
+
+    metrics = grader.Metrics()
+    api = grader.InstrumentedGhApi(owner=args.org, token=_require_env(parser, 'GH_TOKEN'),
+                                   metrics=metrics)
+    with metrics.phase('rerun_workflows'):
+        outcomes = grader.rerun_all_workflows_for_assignment(
+            api, args.org, args.assignment, args.workflow, max_workers=args.workers,
+            discovery=args.discovery)
+    for repo, outcome in outcomes.items():
+        print(f"{repo}: {outcome}")
+
+    _report_metrics(args, metrics)
+    return 0
+
+
+def serve(parser, args):
+    """Grade the repo of every workflow_run webhook delivered until interrupted."""
+    _configure(parser, args)
+    secret = _require_env(parser, 'GRADER_WEBHOOK_SECRET')
+
+    metrics = grader.Metrics()
+    webhook_grader = webhook.WebhookGrader(
+        args.org, canvas_token=_require_env(parser, 'CANVAS_TOKEN'),
+        course_id=_require_env(parser, 'CANVAS_COURSE_ID'),
+        canvas_url=os.environ.get('CANVAS_URL', 'https://utexas.instructure.com'),
+        assignments=args.assignments,
+        google_creditials=os.environ.get('GOOGLE_CLIENT_SECRET'),
+        workflow_filename=args.workflow, multiplier=_multiplier(args), force=args.force,
+        metrics=metrics, verbose=not args.quiet)
+    server = webhook.WebhookServer(webhook_grader, secret, host=args.host, port=args.port)
+    print(f"Grading workflow_run webhooks of {args.org} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        _report_metrics(args, metrics)
+    return 0
+
+
+def replay(parser, args):
+    """Post a signed webhook delivery to a grader server and print its response."""
+    for name, value in args.env:
+        os.environ[name] = value
+    secret = _require_env(parser, 'GRADER_WEBHOOK_SECRET')
+
+    if args.payload:
+        with open(args.payload) as f:
+            payload = json.load(f)
+    else:
+        org = args.org or _require_env(parser, 'GITHUB_REPOSITORY').split('/')[0]
+        commit_time = args.commit_time or datetime.now(timezone.utc).isoformat()
+        payload = webhook.workflow_run_payload(org, args.repo, {
+            'id': args.run_id if args.run_id is not None else int(time.time()),
+            'path': f'.github/workflows/{args.workflow}', 'status': 'completed',
+            'conclusion': args.conclusion, 'head_commit': {'timestamp': commit_time}})
+
+    status, response = webhook.send_webhook(args.url, payload, secret, event=args.event)
+    print(f"{status}: {json.dumps(response)}")
+    return 0 if status == 200 else 1
+
+
+def encode(parser, args):
+    """Print a Google client secret file encoded for the GOOGLE_CLIENT_SECRET variable."""
+    print(grader.google_creditial_encoder(args.secret))
+    return 0
+
+
+def status(parser, args):
+    """Print the grades recorded in the grade state cache."""
+    if args.cache_dir:
+        os.environ['GRADER_CACHE_DIR'] = args.cache_dir
+    state_file = grader.cache_path('state.sqlite')
+    if state_file is None or not os.path.isfile(state_file):
+        print('No grades recorded: set GRADER_CACHE_DIR or pass --cache-dir')
+        return 1
+
+    state = grader.GradeStateStore(state_file)
+    try:
+        if args.assignment is None:
+            for summary in state.summary():
+                graded_at = datetime.fromtimestamp(summary['last_graded_at'])
+                print(f"{summary['assignment']}: {summary['repos']} repos, "
+                      f"mean score {summary['mean_score']:.2f}, "
+                      f"last graded {graded_at:%Y-%m-%d %H:%M}")
+        else:
+            for record in state.records(args.assignment):
+                print(f"{record['repo']}: {record['score']} ({record['conclusion']}, "
+                      f"run {record['run_id']}, committed {record['commit_time']})")
+    finally:
+        state.close()
+    return 0
+
+
+def benchmark(parser, args):
+    """Benchmark a trigger against a recorded fixture."""
+    report = grader.benchmark_rerun(args.fixture, args.assignment, args.workflow,
+                                    max_workers=args.workers,
+                                    latency_scale=args.latency_scale)
+    print(f"Dry run: re-running {report['repos']} repos takes "
+          f"{report['calls']} API calls in {report['wall_time']:.2f} s")
+    for endpoint, calls in report['calls_by_endpoint'].items():
+        print(f"    {endpoint}: {calls}")
     return 0
 
 
+COMMANDS = {'grade': grade, 'trigger': trigger, 'serve': serve, 'replay': replay,
+            'encode': encode, 'status': status, 'benchmark': benchmark}
+
+
+def main(argv=None):
+    """Console script for github_canvas_grader."""
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    return COMMANDS[args.command](parser, args)
+
+
 if __name__ == "__main__":
     sys.exit(main())  # pragma: no cover
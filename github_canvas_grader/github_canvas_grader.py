@@ -15,12 +15,12 @@
 """grader
 
 Usage:
-  grader.py <assignment_name>
-  grader.py <assignment_name> [(--env <NAME> <VALUE>)...]
-  grader.py <assignment_name> [--due (<DATE> <TIME> <TIME_ZONE> <MULTIPLIER>)]
-  grader.py <assignment_name> [--due (<DATE> <TIME> <TIME_ZONE> <MULTIPLIER>) (--env <NAME> <VALUE>)...]
+  grader.py <assignment_name> [--bulk] [--workers=<N>] [--graphql] [--metrics] [--metrics-file=<FILE>] [--force] [--late-policy=<FILE>]
+  grader.py <assignment_name> [--bulk] [--workers=<N>] [--graphql] [--metrics] [--metrics-file=<FILE>] [--force] [--late-policy=<FILE>] [(--env <NAME> <VALUE>)...]
+  grader.py <assignment_name> [--bulk] [--workers=<N>] [--graphql] [--metrics] [--metrics-file=<FILE>] [--force] [--due (<DATE> <TIME> <TIME_ZONE> <MULTIPLIER>)]
+  grader.py <assignment_name> [--bulk] [--workers=<N>] [--graphql] [--metrics] [--metrics-file=<FILE>] [--force] [--due (<DATE> <TIME> <TIME_ZONE> <MULTIPLIER>) (--env <NAME> <VALUE>)...]
   grader.py [-E] <google_client_secret.json>
-  grader.py [-T] <assignment_name>
+  grader.py [-T] <assignment_name> [--workers=<N>] [--dry-run=<FIXTURE>] [--metrics] [--metrics-file=<FILE>]
 
 Options:
   -h --help      Show this screen.
@@ -30,18 +30,41 @@ Options:
   -d --due       Specify due date/time with (format YYYY-MM-DD HH:MM:SS TZ multiplier)
   -E --encode    Encode a Google Client secret file
   -T --trigger   Trigger a rerun of all assignment workflows
+  -b --bulk      Upload all grades with Canvas bulk update_grades calls
+  -w --workers=<N>  Number of concurrent GitHub requests [default: 8]
+  -g --graphql   Fetch workflow results with batched GraphQL queries
+  -f --force     Upload grades even if they are unchanged since the last run
+  --dry-run=<FIXTURE>  Benchmark a trigger against a recorded fixture without calling Github
+  -m --metrics   Print the time spent in each phase and API endpoint
+  --metrics-file=<FILE>  Write the time spent in each phase and API endpoint as JSON
+  -l --late-policy=<FILE>  Score late submissions with a JSON tiered late-penalty policy
 """
 
+# pandas, numpy, gspread, canvasapi, ghapi and dateutil are imported by the
+# functions that use them, so that importing the grader stays fast.
+from __future__ import annotations
+
 from docopt import docopt
-from ghapi.all import GhApi, paged
-from canvasapi import Canvas
-import pandas as pd
 import os.path
-from dateutil.tz import gettz
-import dateutil.parser
 import json
 import base64
-import gspread
+import csv
+import time
+import threading
+import sqlite3
+import pickle
+import re
+import fnmatch
+from collections import defaultdict
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ghapi.all import GhApi
 
 def google_creditial_encoder(json_file):
     """
@@ -80,34 +103,678 @@ def google_creditial_decoder(base64_byte_string:str):
     base64_str = base64.b64decode(base64_byte_string)
     return json.loads(base64_str.decode('ascii'))
 
-def username_map_from_google_sheet(creditials:str, classname:str):
+class UsernameMap:
+    """
+    A map of lowercase Github usernames to lowercase EIDs.
+
+    Rows repeating a username with the same EID are recorded in
+    `duplicates`; usernames given different EIDs are recorded in `conflicts`
+    and left out of the map, since the right EID cannot be known. EIDs
+    claimed by several usernames are recorded in `shared_eids` but kept.
+
+    Parameters
+    ----------
+    pairs : iterable
+        ``(github_username, eid)`` pairs. Pairs missing either value are skipped.
+    """
+
+    __slots__ = ('eids', 'duplicates', 'conflicts', 'shared_eids')
+
+    def __init__(self, pairs):
+        self.eids = dict()
+        self.duplicates = list()
+        self.conflicts = dict()
+        self.shared_eids = dict()
+
+        usernames_by_eid = dict()
+        for github_username, eid in pairs:
+            github_username = str(github_username or '').strip().lower()
+            eid = str(eid or '').strip().lower()
+            if not github_username or not eid:
+                continue
+            if github_username in self.conflicts:
+                self.conflicts[github_username].add(eid)
+            elif github_username not in self.eids:
+                self.eids[github_username] = eid
+                usernames_by_eid.setdefault(eid, list()).append(github_username)
+            elif self.eids[github_username] == eid:
+                self.duplicates.append(github_username)
+            else:
+                self.conflicts[github_username] = {self.eids.pop(github_username), eid}
+
+        for eid, usernames in usernames_by_eid.items():
+            usernames = [username for username in usernames if username in self.eids]
+            if len(usernames) > 1:
+                self.shared_eids[eid] = usernames
+
+    @classmethod
+    def from_csv(cls, path: str):
+        """
+        Read a csv file with ``Github Username`` and ``EID`` columns.
+
+        The file is read as UTF-8, with or without the byte order mark added
+        by Excel.
+
+        Raises
+        ------
+        ValueError
+            If either column is missing.
+        """
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.DictReader(f)
+            missing = [column for column in ('Github Username', 'EID')
+                       if column not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"{path} has no {' or '.join(missing)} column")
+            return cls((row['Github Username'], row['EID']) for row in reader)
+
+    @classmethod
+    def from_records(cls, records: list):
+        """Build the map from dictionaries with ``Github Username`` and ``EID`` keys."""
+        return cls((record.get('Github Username'), record.get('EID')) for record in records)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build the map from a DataFrame indexed by Github username with an ``EID`` column."""
+        return cls(zip(df.index, df['EID']))
+
+    def eid_for(self, github_username: str):
+        """
+        Look up the EID of a Github username.
+
+        Parameters
+        ----------
+        github_username : str
+            The Github username, in any case.
+
+        Returns
+        -------
+        str
+            The lowercase EID.
+
+        Raises
+        ------
+        KeyError
+            If the username is not in the map or has conflicting EIDs.
+        """
+        github_username = github_username.lower()
+        try:
+            return self.eids[github_username]
+        except KeyError:
+            if github_username in self.conflicts:
+                raise KeyError(f"{github_username} has conflicting EIDs: "
+                               f"{', '.join(sorted(self.conflicts[github_username]))}") from None
+            raise
+
+    def to_series(self):
+        """Return the map as a pandas Series of EIDs indexed by Github username."""
+        import pandas as pd
+
+        return pd.Series(self.eids, dtype=object, name='EID')
+
+    def report(self):
+        """Print the duplicates and conflicts found while building the map."""
+        for github_username in sorted(set(self.duplicates)):
+            print(f"Duplicate username map entry: {github_username}")
+        for github_username, eids in sorted(self.conflicts.items()):
+            print(f"Conflicting EIDs for {github_username}: {', '.join(sorted(eids))}")
+        for eid, usernames in sorted(self.shared_eids.items()):
+            print(f"EID {eid} is shared by {', '.join(usernames)}")
+
+    def __len__(self):
+        return len(self.eids)
+
+    def __contains__(self, github_username):
+        return github_username.lower() in self.eids
+
+def as_username_map(username_map):
+    """Return `username_map` as a `UsernameMap`, converting a DataFrame from older callers."""
+    if isinstance(username_map, UsernameMap):
+        return username_map
+    return UsernameMap.from_frame(username_map)
+
+def username_map_from_google_sheet(creditials:str, classname:str, cache_file:str=None):
     """
     Create a mapping of Github usernames to EIDs from a Google Sheet.
 
+    With a `cache_file`, the spreadsheet key and the parsed map are pickled
+    along with the sheet's Drive ``modifiedTime``. Later calls skip the Drive
+    search by title and only fetch the records again if the sheet changed.
+
     Parameters
     ----------
     creditials : str
         Google credentials.
     classname : str
         Name of the class.
+    cache_file : str, optional
+        Path of the pickle file caching the sheet.
 
     Returns
     -------
-    DataFrame
+    UsernameMap
         A mapping of Github usernames to EIDs.
     """
+    import gspread
+
     creditials = google_creditial_decoder(creditials)
 
     gc = gspread.service_account_from_dict(creditials)
 
-    sh1 = gc.open(f'{classname} Github Names').sheet1
-    df = pd.DataFrame(sh1.get_all_records())
-    df['Github Username'] = df['Github Username'].apply(lambda s: s.lower())
-    df['EID'] = df['EID'].apply(lambda s: s.lower())
+    title = f'{classname} Github Names'
+    cached = None
+    if cache_file is not None and os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if (cached.get('title') != title or
+            not isinstance(cached.get('username_map'), UsernameMap)):
+            cached = None
+
+    if cached is not None:
+        key = cached['key']
+        try:
+            modified_time = gc.get_file_drive_metadata(key)['modifiedTime']
+        except gspread.exceptions.APIError:
+            # The cached sheet was deleted or is no longer shared with us
+            cached = None
+        else:
+            if modified_time == cached['modified_time']:
+                return cached['username_map']
+
+    if cached is None:
+        files = [file for file in gc.list_spreadsheet_files(title) if file['name'] == title]
+        if not files:
+            raise gspread.exceptions.SpreadsheetNotFound(title)
+        key, modified_time = files[0]['id'], files[0]['modifiedTime']
+
+    sh1 = gc.open_by_key(key).sheet1
+    username_map = UsernameMap.from_records(sh1.get_all_records())
+
+    if cache_file is not None:
+        with open(f'{cache_file}.tmp', 'wb') as f:
+            pickle.dump({'title': title, 'key': key, 'modified_time': modified_time,
+                         'username_map': username_map}, f)
+        os.replace(f'{cache_file}.tmp', cache_file)
+
+    return username_map
+
+def get_header(headers: dict, name: str):
+    """
+    Case-insensitively retrieve a header from a dictionary of response headers.
+
+    Parameters
+    ----------
+    headers : dict
+        The response headers.
+    name : str
+        The header name.
+
+    Returns
+    -------
+    str
+        The header value, or None if the header is missing.
+    """
+    name = name.lower()
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            return value
+
+class RequestScheduler:
+    """
+    Schedule Github and Canvas API calls within both services' rate limits.
+
+    The scheduler tracks Github's ``X-RateLimit-Remaining``/``X-RateLimit-Reset``
+    budget and Canvas's ``X-Rate-Limit-Remaining`` cost bucket, pauses calls
+    when a budget runs low, honours ``Retry-After`` and retries throttled
+    calls with exponential backoff. The number of calls allowed in flight is
+    adapted: it is halved whenever a call is throttled and grows by one after
+    a run of successful calls, up to `max_concurrency`.
+
+    Parameters
+    ----------
+    max_concurrency : int, optional
+        Maximum number of calls in flight, by default 8.
+    max_retries : int, optional
+        Number of times a throttled call is retried, by default 5.
+    backoff : float, optional
+        Initial backoff in seconds when no retry delay is advertised, by default 1.0.
+    github_reserve : int, optional
+        Github requests kept in reserve before pausing until the reset time, by default 10.
+    canvas_reserve : float, optional
+        Canvas bucket units kept in reserve before pausing, by default 100.0.
+    canvas_refill_rate : float, optional
+        Canvas bucket units assumed to refill per second, by default 10.0.
+    """
+
+    def __init__(self, max_concurrency: int=8, max_retries: int=5, backoff: float=1.0,
+                 github_reserve: int=10, canvas_reserve: float=100.0,
+                 canvas_refill_rate: float=10.0):
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.github_reserve = github_reserve
+        self.canvas_reserve = canvas_reserve
+        self.canvas_refill_rate = canvas_refill_rate
+        self.github_remaining = None
+        self.github_reset = None
+        self.canvas_remaining = None
+        self.paused_until = {'github': 0.0, 'canvas': 0.0}
+        self.throttled = 0
+        self._active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def observe_github(self, headers: dict):
+        """Update the Github budget from a response's headers."""
+        remaining = get_header(headers, 'X-RateLimit-Remaining')
+        reset = get_header(headers, 'X-RateLimit-Reset')
+        with self._condition:
+            if remaining is not None:
+                self.github_remaining = int(remaining)
+            if reset is not None:
+                self.github_reset = float(reset)
+
+    def observe_canvas(self, response, *args, **kwargs):
+        """Update the Canvas budget from a response; usable as a requests response hook."""
+        remaining = get_header(response.headers, 'X-Rate-Limit-Remaining')
+        if remaining is not None:
+            with self._condition:
+                self.canvas_remaining = float(remaining)
+
+    def install_canvas_hook(self, canvas_object):
+        """
+        Track the Canvas budget of every response received by a Canvas object's requester.
+
+        Parameters
+        ----------
+        canvas_object : canvasapi.canvas_object.CanvasObject
+            Any Canvas object, e.g. a course. All objects derived from the
+            same Canvas instance share its requester.
+        """
+        canvas_object._requester._session.hooks['response'].append(self.observe_canvas)
+
+    def _budget_delay(self, service: str):
+        now = time.time()
+        delay = self.paused_until[service] - now
+        if service == 'github':
+            if (self.github_remaining is not None and self.github_reset is not None and
+                self.github_remaining <= self.github_reserve):
+                delay = max(delay, self.github_reset - now)
+        elif self.canvas_remaining is not None and self.canvas_remaining < self.canvas_reserve:
+            delay = max(delay, (self.canvas_reserve - self.canvas_remaining) /
+                        self.canvas_refill_rate)
+        return max(delay, 0.0)
+
+    def _acquire(self, service: str):
+        while True:
+            with self._condition:
+                while self._active >= self.concurrency:
+                    self._condition.wait()
+                delay = self._budget_delay(service)
+                if delay == 0:
+                    self._active += 1
+                    return
+            time.sleep(delay)
+
+    def _release(self, throttled: bool):
+        with self._condition:
+            self._active -= 1
+            if throttled:
+                self.throttled += 1
+                self._successes = 0
+                self.concurrency = max(1, self.concurrency // 2)
+            else:
+                self._successes += 1
+                if (self._successes >= self.concurrency and
+                    self.concurrency < self.max_concurrency):
+                    self.concurrency += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def _throttle_delay(self, service: str, error: Exception, attempt: int):
+        """Return the retry delay if `error` means the call was throttled, otherwise None."""
+        from canvasapi.exceptions import Forbidden, RateLimitExceeded
+
+        default = self.backoff * 2 ** attempt
+
+        if service == 'canvas':
+            if (isinstance(error, RateLimitExceeded) or
+                (isinstance(error, Forbidden) and 'rate limit' in str(error).lower())):
+                return default
+            return None
+
+        code = getattr(error, 'code', None)
+        headers = getattr(error, 'headers', None) or {}
+        if code not in (403, 429):
+            return None
+
+        retry_after = get_header(headers, 'Retry-After')
+        if retry_after is not None:
+            return float(retry_after)
+
+        if get_header(headers, 'X-RateLimit-Remaining') == '0':
+            reset = get_header(headers, 'X-RateLimit-Reset')
+            return max(float(reset) - time.time(), 0.0) if reset else default
+
+        # Secondary rate limits are reported as 403s mentioning the rate limit
+        if code == 429 or 'rate limit' in str(getattr(error, 'msg', error)).lower():
+            return default
+
+        return None
+
+    def call(self, service: str, fn, *args, api=None, **kwargs):
+        """
+        Call `fn` within the budget of `service`, retrying it when throttled.
+
+        Parameters
+        ----------
+        service : str
+            Either ``'github'`` or ``'canvas'``.
+        fn : callable
+            The API call to make.
+        *args
+            Positional arguments of `fn`.
+        api : GhApi, optional
+            The Github API object whose received headers update the Github budget.
+        **kwargs
+            Keyword arguments of `fn`.
+
+        Returns
+        -------
+        object
+            The return value of `fn`.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire(service)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._throttle_delay(service, e, attempt)
+                self._release(throttled=delay is not None)
+                if delay is None or attempt == self.max_retries:
+                    raise
+                with self._condition:
+                    self.paused_until[service] = max(self.paused_until[service],
+                                                     time.time() + delay)
+                continue
+
+            if api is not None:
+                self.observe_github(api.recv_hdrs)
+            self._release(throttled=False)
+            return result
+
+    def github(self, api, fn, *args, **kwargs):
+        """Call a Github API function `fn` through the scheduler."""
+        return self.call('github', fn, *args, api=api, **kwargs)
+
+    def canvas(self, fn, *args, **kwargs):
+        """Call a Canvas API function `fn` through the scheduler."""
+        return self.call('canvas', fn, *args, **kwargs)
+
+def percentile(values: list, q: float):
+    """
+    Compute a percentile of a list of numbers with the nearest-rank method.
+
+    Parameters
+    ----------
+    values : list
+        The numbers.
+    q : float
+        The percentile, between 0 and 100.
+
+    Returns
+    -------
+    float
+        The percentile, or 0.0 if `values` is empty.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(-(-q * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+class Metrics:
+    """
+    Record the wall time of grading phases and the cost of every API call.
+
+    API calls are grouped by service and endpoint; for each endpoint the
+    number of calls, errors and bytes received and the total, median and
+    95th percentile latency are reported. Github calls are recorded by an
+    `InstrumentedGhApi` and Canvas calls by a requests response hook, see
+    `install_canvas_hook`.
+    """
+
+    def __init__(self):
+        self.phases = dict()
+        self.latencies = defaultdict(list)
+        self.bytes = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time the enclosed block as the grading phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def record(self, service: str, endpoint: str, elapsed: float, nbytes: int=0,
+               error: bool=False):
+        """
+        Record an API call.
+
+        Parameters
+        ----------
+        service : str
+            Either ``'github'`` or ``'canvas'``.
+        endpoint : str
+            The HTTP method and path template of the call.
+        elapsed : float
+            The latency of the call in seconds.
+        nbytes : int, optional
+            The size of the response body, by default 0.
+        error : bool, optional
+            Whether the call failed, by default False.
+        """
+        key = (service, endpoint)
+        with self._lock:
+            self.latencies[key].append(elapsed)
+            self.bytes[key] += nbytes
+            if error:
+                self.errors[key] += 1
+
+    def observe_canvas(self, response, *args, **kwargs):
+        """Record a Canvas response; usable as a requests response hook."""
+        path = urlsplit(response.url).path
+        path = re.sub(r'/sis_login_id:[^/]+', '/sis_login_id::login_id', path)
+        path = re.sub(r'/\d+(?=/|$)', '/:id', path)
+        self.record('canvas', f'{response.request.method} {path}',
+                    response.elapsed.total_seconds(), len(response.content),
+                    error=response.status_code >= 400)
+
+    def install_canvas_hook(self, canvas_object):
+        """
+        Record every response received by a Canvas object's requester.
+
+        Parameters
+        ----------
+        canvas_object : canvasapi.canvas_object.CanvasObject
+            Any Canvas object, e.g. a course.
+        """
+        canvas_object._requester._session.hooks['response'].append(self.observe_canvas)
+
+    def summary(self):
+        """
+        Summarize the recorded phases and API calls.
+
+        Returns
+        -------
+        dict
+            ``wall_time`` of the whole run, ``phases`` mapping phase names to
+            seconds, ``services`` with the totals of each service and
+            ``endpoints`` mapping ``'service METHOD path'`` to the calls,
+            errors, bytes, total time, p50 and p95 latency of each endpoint.
+        """
+        with self._lock:
+            endpoints = dict()
+            services = dict()
+            for (service, endpoint), latencies in sorted(self.latencies.items()):
+                stats = {'calls': len(latencies), 'errors': self.errors[(service, endpoint)],
+                         'bytes': self.bytes[(service, endpoint)],
+                         'total_time': sum(latencies),
+                         'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95)}
+                endpoints[f'{service} {endpoint}'] = stats
+                totals = services.setdefault(service, {'calls': 0, 'errors': 0, 'bytes': 0,
+                                                       'total_time': 0.0})
+                for name in totals:
+                    totals[name] += stats[name]
+
+            return {'wall_time': time.perf_counter() - self.started,
+                    'phases': dict(self.phases), 'services': services,
+                    'endpoints': endpoints}
+
+    def print_summary(self):
+        """Print a summary of the recorded phases and API calls."""
+        summary = self.summary()
+        print(f"Wall time: {summary['wall_time']:.2f} s")
+        print('Phases:')
+        for name, seconds in summary['phases'].items():
+            print(f"    {name}: {seconds:.2f} s")
+        print('API calls:')
+        for service, totals in summary['services'].items():
+            print(f"    {service}: {totals['calls']} calls, {totals['errors']} errors, "
+                  f"{totals['bytes']} bytes, {totals['total_time']:.2f} s")
+        for endpoint, stats in summary['endpoints'].items():
+            print(f"    {endpoint}: {stats['calls']} calls, {stats['bytes']} bytes, "
+                  f"p50 {stats['p50'] * 1000:.0f} ms, p95 {stats['p95'] * 1000:.0f} ms")
+
+    def write_json(self, path: str):
+        """Write the summary of the recorded phases and API calls to a JSON file."""
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+class InstrumentedGhApi:
+    """
+    A ``GhApi`` recording the latency and response size of every call in a `Metrics`.
+
+    Calls are grouped by their path template, e.g.
+    ``GET /repos/{owner}/{repo}/actions/workflows/{workflow_id}/runs``.
+    The ``GhApi`` subclass is created on first use, so that ghapi is only
+    imported when it is needed.
+
+    Parameters
+    ----------
+    *args
+        Positional arguments of ``GhApi``.
+    metrics : Metrics, optional
+        The metrics to record the calls in, by default a new one.
+    **kwargs
+        Keyword arguments of ``GhApi``.
+    """
+
+    _class = None
+
+    def __new__(cls, *args, metrics: Metrics=None, **kwargs):
+        if cls._class is None:
+            cls._class = _instrumented_ghapi_class()
+        return cls._class(*args, metrics=metrics, **kwargs)
+
+def _instrumented_ghapi_class():
+    from ghapi.all import GhApi
+
+    class _InstrumentedGhApi(GhApi):
+
+        def __init__(self, *args, metrics: Metrics=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.metrics = metrics if metrics is not None else Metrics()
 
-    return df.set_index(['Github Username'])
+        def __call__(self, path: str, verb: str=None, *args, **kwargs):
+            endpoint = f"{(verb or ('POST' if kwargs.get('data') else 'GET')).upper()} {path}"
+            start = time.perf_counter()
+            try:
+                result = super().__call__(path, verb, *args, **kwargs)
+            except HTTPError as e:
+                self.metrics.record('github', endpoint, time.perf_counter() - start,
+                                    int(get_header(e.headers, 'Content-Length') or 0),
+                                    error=True)
+                raise
+            self.metrics.record('github', endpoint, time.perf_counter() - start,
+                                int(get_header(self.recv_hdrs, 'Content-Length') or 0))
+            return result
+
+    return _InstrumentedGhApi
+
+def list_org_repos_cached(api: GhApi, org: str, cache_file: str, per_page: int=100):
+    """
+    Retrieve the names of all repositories in an organization using an on-disk ETag cache.
+
+    Every page of the listing is stored with its ETag and requested again
+    with ``If-None-Match``. Unchanged pages are answered with ``304 Not
+    Modified``, which carries no payload and does not count against the
+    Github rate limit. Repositories are listed oldest first, so creating a
+    repository only changes the last page.
+
+    Parameters
+    ----------
+    api : GhApi
+        The Github API object.
+    org : str
+        The organization name.
+    cache_file : str
+        Path of the JSON file holding the cached pages.
+    per_page : int, optional
+        Number of repositories per page, by default 100.
+
+    Returns
+    -------
+    list
+        The names of all repositories in the organization.
+    """
+    caches = dict()
+    if os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            caches = json.load(f)
+
+    key = f'created-asc-{per_page}'
+    cached_pages = caches.get(org, dict()).get(key, dict())
+    pages = dict()
 
-def filter_repos(api: GhApi, org: str, filter_string: str):
+    repos = list()
+    page = 1
+    while True:
+        cached = cached_pages.get(str(page))
+        headers = {'If-None-Match': cached['etag']} if cached else None
+        try:
+            items = api('/orgs/{org}/repos', 'GET', headers=headers,
+                        route={'org': org},
+                        query={'sort': 'created', 'direction': 'asc',
+                               'per_page': per_page, 'page': page})
+            names = [item['name'] for item in items]
+            pages[str(page)] = {'etag': get_header(api.recv_hdrs, 'ETag'),
+                                'names': names}
+        except HTTPError as e:
+            if e.code != 304 or cached is None:
+                raise
+            names = cached['names']
+            pages[str(page)] = cached
+
+        repos.extend(names)
+        if len(names) < per_page:
+            break
+        page += 1
+
+    caches.setdefault(org, dict())[key] = pages
+    with open(cache_file, 'w') as f:
+        json.dump(caches, f)
+
+    return repos
+
+def filter_repos(api: GhApi, org: str, filter_string: str, cache_file: str=None):
     """
     Retrieve a list of repositories from a given organization that match a given filter string.
 
@@ -119,24 +786,119 @@ def filter_repos(api: GhApi, org: str, filter_string: str):
         The organization name.
     filter_string : str
         The string to filter the repository names by.
+    cache_file : str, optional
+        Path of an ETag cache for the organization's repository listing,
+        see `list_org_repos_cached`.
 
     Returns
     -------
     list
         A list of repository names that match the filter string.
     """
+    from ghapi.all import paged
+
+    if cache_file is not None:
+        return [name for name in list_org_repos_cached(api, org, cache_file)
+                if filter_string in name]
+
     repos = list()
-    for page in paged(api.repos.list_for_org, org=org):
+    for page in paged(api.repos.list_for_org, org=org, per_page=100):
         for item in page:
             if filter_string in item.get('name'):
                 repos.append(item['name'])
 
     return repos
 
-def get_latest_workflow_run(api: GhApi, repo: str, workflow_filename: str='main.yml'):
+def search_repos(api: GhApi, org: str, filter_string: str):
+    """
+    Retrieve the repositories of an organization matching a filter string with Github's repository search.
+
+    Only the matching repositories are transferred. The search index matches
+    whole name tokens, caps results at 1000 and lags behind newly created
+    repositories, so the results may silently miss repositories, e.g. those
+    of students who accepted an assignment shortly before the deadline.
+
+    Parameters
+    ----------
+    api : GhApi
+        The Github API object.
+    org : str
+        The organization name.
+    filter_string : str
+        The string to filter the repository names by.
+
+    Returns
+    -------
+    list
+        A list of repository names that match the filter string.
+    None
+        If the search results are incomplete or exceed the search limit.
+    """
+    repos = list()
+    page = 1
+    while True:
+        results = api.search.repos(q=f'{filter_string} org:{org} in:name',
+                                   per_page=100, page=page)
+        if results['incomplete_results'] or results['total_count'] > 1000:
+            return None
+
+        for item in results['items']:
+            if filter_string in item['name']:
+                repos.append(item['name'])
+
+        if not results['items'] or page * 100 >= results['total_count']:
+            return repos
+        page += 1
+
+def discover_repos(api: GhApi, org: str, filter_string: str, backend: str='list',
+                   cache_file: str=None):
+    """
+    Retrieve the repositories of an organization that match a given filter string.
+
+    By default the full organization listing of `filter_repos` is used, which
+    with `cache_file` costs a single conditional request when no repository
+    was created since the last run. The opt-in ``'search'`` backend only
+    fetches matching repositories, but may miss repositories the search
+    index has not caught up with, see `search_repos`; the listing is only
+    used if the search fails, is incomplete or finds nothing.
+
+    Parameters
+    ----------
+    api : GhApi
+        The Github API object.
+    org : str
+        The organization name.
+    filter_string : str
+        The string to filter the repository names by.
+    backend : str, optional
+        Either ``'list'`` or ``'search'``, by default 'list'.
+    cache_file : str, optional
+        Path of an ETag cache for the full organization listing.
+
+    Returns
+    -------
+    list
+        A list of repository names that match the filter string.
+    """
+    if backend == 'search':
+        try:
+            repos = search_repos(api, org, filter_string)
+        except Exception as e:
+            print(f"Repository search failed, listing all repos instead: {e}")
+            repos = None
+        if repos:
+            return repos
+
+    return filter_repos(api, org, filter_string, cache_file)
+
+def get_latest_workflow_run(api: GhApi, repo: str, workflow_filename: str='main.yml',
+                            branch: str=None, status: str=None):
     """
     Get the latest workflow run for a given repository and workflow filename.
 
+    Only the runs of the given workflow are queried, one run per page, so
+    each lookup transfers a single run.
+
     Parameters
     ----------
     api : GhApi
@@ -145,6 +907,10 @@ def get_latest_workflow_run(api: GhApi, repo: str, workflow_filename: str='main.
         The repository name.
     workflow_filename : str, optional
         The workflow filename, by default 'main.yml'.
+    branch : str, optional
+        Only consider runs on this branch.
+    status : str, optional
+        Only consider runs with this status or conclusion, e.g. 'completed'.
 
     Returns
     -------
@@ -153,14 +919,22 @@ def get_latest_workflow_run(api: GhApi, repo: str, workflow_filename: str='main.
     None
         If no workflow runs are found.
     """
-    runs = api.actions.list_workflow_runs_for_repo(repo=repo)
-
-    if runs['total_count'] == 0:
+    filters = {k: v for k, v in (('branch', branch), ('status', status))
+               if v is not None}
+    try:
+        runs = api.actions.list_workflow_runs(repo=repo,
+                                              workflow_id=workflow_filename,
+                                              per_page=1, **filters)
+    except HTTPError as e:
+        if e.code == 404:
+            # The repository has no workflow with this filename
+            return None
+        raise
+
+    if runs['total_count'] == 0 or not runs['workflow_runs']:
         return None
     else:
-        for i, workflow_run in enumerate(runs['workflow_runs']):
-            if workflow_filename in workflow_run['name']:
-                return runs['workflow_runs'][i]
+        return runs['workflow_runs'][0]
 
 
 def get_latest_workflow_conclusion(api, repo: str, workflow_filename: str='main.yml'):
@@ -212,11 +986,259 @@ def get_latest_workflow_commit_time_and_conclusion(api, repo: str,
     """
     run = get_latest_workflow_run(api, repo, workflow_filename)
 
+    return workflow_run_commit_time_and_conclusion(run)
+
+def fetch_latest_workflow_runs(api, repos: list, workflow_filename: str='main.yml',
+                               max_workers: int=8, scheduler=None):
+    """
+    Concurrently get the latest workflow run for many repositories.
+
+    Parameters
+    ----------
+    api : object
+        The GitHub API object.
+    repos : list
+        The repository names.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    max_workers : int, optional
+        The maximum number of concurrent requests (default is 8).
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Github's rate limits.
+
+    Returns
+    -------
+    dict
+        A mapping of repository names to workflow runs in the same order as
+        `repos`. Repositories without runs or whose lookup failed map to None.
+    """
+    def fetch(repo):
+        try:
+            if scheduler is not None:
+                return scheduler.github(api, get_latest_workflow_run,
+                                        api, repo, workflow_filename)
+            return get_latest_workflow_run(api, repo, workflow_filename)
+        except Exception as e:
+            print(f"Failed to fetch workflow runs for {repo}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(repos, executor.map(fetch, repos)))
+
+def workflow_run_commit_time_and_conclusion(run: dict):
+    """
+    Get the commit time and conclusion of a workflow run.
+
+    Parameters
+    ----------
+    run : dict
+        The workflow run information, or None.
+
+    Returns
+    -------
+    tuple
+        A tuple containing the workflow commit time and conclusion.
+    """
     if run is None:
         return (None, None)
     else:
         return (run['head_commit']['timestamp'], run['conclusion'])
 
+def fetch_workflow_commit_times_and_conclusions(api, repos: list,
+                                                workflow_filename: str='main.yml',
+                                                max_workers: int=8, scheduler=None):
+    """
+    Concurrently get the latest workflow commit time and conclusion for many repositories.
+
+    Parameters
+    ----------
+    api : object
+        The GitHub API object.
+    repos : list
+        The repository names.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    max_workers : int, optional
+        The maximum number of concurrent requests (default is 8).
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Github's rate limits.
+
+    Returns
+    -------
+    dict
+        A mapping of repository names to ``(commit_time, conclusion)`` tuples
+        in the same order as `repos`. Repositories whose lookup failed map to
+        ``(None, None)``.
+    """
+    runs = fetch_latest_workflow_runs(api, repos, workflow_filename,
+                                      max_workers, scheduler)
+
+    return {repo: workflow_run_commit_time_and_conclusion(run)
+            for repo, run in runs.items()}
+
+GRAPHQL_STATUS_FIELDS = """
+    defaultBranchRef {
+      target {
+        ... on Commit {
+          committedDate
+          statusCheckRollup { state }
+          checkSuites(last: 20) {
+            nodes { conclusion workflowRun { databaseId file { path } } }
+          }
+        }
+      }
+    }"""
+
+def graphql_latest_workflow_run(repository: dict, workflow_filename: str='main.yml'):
+    """
+    Extract the latest workflow run from a GraphQL repository result.
+
+    The check suite run by `workflow_filename` is used if the commit has one,
+    otherwise the commit's combined status check rollup, in which case the
+    run has no id.
+
+    Parameters
+    ----------
+    repository : dict
+        The ``repository`` object of a GraphQL response, or None.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+
+    Returns
+    -------
+    dict
+        The workflow run information with the same ``id``, ``conclusion``
+        and ``head_commit`` fields as a REST workflow run.
+    None
+        If no workflow runs are found.
+    """
+    try:
+        commit = repository['defaultBranchRef']['target']
+        commit_time = commit['committedDate']
+    except (KeyError, TypeError):
+        return None
+
+    # Suites are listed oldest first, so the latest matching suite wins
+    for suite in reversed((commit.get('checkSuites') or {}).get('nodes') or []):
+        workflow_run = suite.get('workflowRun') or {}
+        path = (workflow_run.get('file') or {}).get('path', '')
+        if path.split('/')[-1] == workflow_filename:
+            conclusion = suite.get('conclusion')
+            return {'id': workflow_run.get('databaseId'),
+                    'conclusion': conclusion.lower() if conclusion else None,
+                    'head_commit': {'timestamp': commit_time}}
+
+    state = (commit.get('statusCheckRollup') or {}).get('state')
+    conclusion = {'SUCCESS': 'success', 'FAILURE': 'failure',
+                  'ERROR': 'failure'}.get(state)
+
+    if conclusion is None:
+        return None
+    else:
+        return {'id': None, 'conclusion': conclusion,
+                'head_commit': {'timestamp': commit_time}}
+
+def graphql_commit_time_and_conclusion(repository: dict, workflow_filename: str='main.yml'):
+    """
+    Extract the latest commit time and conclusion from a GraphQL repository result.
+
+    Parameters
+    ----------
+    repository : dict
+        The ``repository`` object of a GraphQL response, or None.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+
+    Returns
+    -------
+    tuple
+        A tuple containing the latest commit time and conclusion.
+    """
+    run = graphql_latest_workflow_run(repository, workflow_filename)
+
+    return workflow_run_commit_time_and_conclusion(run)
+
+def fetch_latest_workflow_runs_graphql(api, org: str, repos: list,
+                                       workflow_filename: str='main.yml',
+                                       batch_size: int=50, scheduler=None):
+    """
+    Get the latest workflow run for many repositories with batched GraphQL queries.
+
+    Each query asks for the latest commit on the default branch of
+    `batch_size` repositories at once using aliased ``repository`` fields.
+
+    Parameters
+    ----------
+    api : GhApi
+        The Github API object.
+    org : str
+        The organization name.
+    repos : list
+        The repository names.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    batch_size : int, optional
+        Number of repositories per query (default is 50).
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Github's rate limits.
+
+    Returns
+    -------
+    dict
+        A mapping of repository names to workflow runs, see
+        `graphql_latest_workflow_run`, in the same order as `repos`.
+    """
+    results = dict()
+    for start in range(0, len(repos), batch_size):
+        batch = repos[start:start + batch_size]
+        fields = [f'r{i}: repository(owner: {json.dumps(org)}, name: {json.dumps(repo)}) '
+                  f'{{{GRAPHQL_STATUS_FIELDS}\n  }}'
+                  for i, repo in enumerate(batch)]
+        query = {'query': 'query {\n  ' + '\n  '.join(fields) + '\n}'}
+        if scheduler is not None:
+            response = scheduler.github(api, api, '/graphql', 'POST', data=query)
+        else:
+            response = api('/graphql', 'POST', data=query)
+        data = response.get('data') or {}
+        for i, repo in enumerate(batch):
+            results[repo] = graphql_latest_workflow_run(data.get(f'r{i}'),
+                                                        workflow_filename)
+
+    return results
+
+def fetch_workflow_commit_times_and_conclusions_graphql(api, org: str, repos: list,
+                                                        workflow_filename: str='main.yml',
+                                                        batch_size: int=50, scheduler=None):
+    """
+    Get the latest commit time and conclusion for many repositories with batched GraphQL queries.
+
+    Parameters
+    ----------
+    api : GhApi
+        The Github API object.
+    org : str
+        The organization name.
+    repos : list
+        The repository names.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    batch_size : int, optional
+        Number of repositories per query (default is 50).
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Github's rate limits.
+
+    Returns
+    -------
+    dict
+        A mapping of repository names to ``(commit_time, conclusion)`` tuples
+        in the same order as `repos`.
+    """
+    runs = fetch_latest_workflow_runs_graphql(api, org, repos, workflow_filename,
+                                              batch_size, scheduler)
+
+    return {repo: workflow_run_commit_time_and_conclusion(run)
+            for repo, run in runs.items()}
+
 def strip_github_username(repo: str):
     """
     strip_github_username(repo: str)
@@ -235,7 +1257,7 @@ def strip_github_username(repo: str):
     """
     return '-'.join(repo.split('-')[1:]).lower()
 
-def rerun_latest_workflow(api, repo, workflow_filename: str='main.yml'):
+def rerun_latest_workflow(api, repo, workflow_filename: str='main.yml', scheduler=None):
     """Re-run the latest workflow for a given repository.
 
     Parameters
@@ -246,25 +1268,44 @@ def rerun_latest_workflow(api, repo, workflow_filename: str='main.yml'):
         The repository name.
     workflow_filename : str, optional
         The name of the workflow file, by default 'main.yml'.
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Github's rate limits.
 
     Returns
     -------
-    None
-        This function does not return anything.
+    str
+        The outcome: 'rerun requested', 'no workflow runs' or a message
+        starting with 'failed' describing the error.
     """
-    run_id = get_latest_workflow_run(api, repo, workflow_filename)['id']
-
     try:
-        api.actions.re_run_workflow(repo=repo, run_id=run_id)
-    except:
-        pass
+        if scheduler is not None:
+            run = scheduler.github(api, get_latest_workflow_run, api, repo,
+                                   workflow_filename)
+        else:
+            run = get_latest_workflow_run(api, repo, workflow_filename)
 
-    return
+        if run is None:
+            return 'no workflow runs'
+
+        if scheduler is not None:
+            scheduler.github(api, api.actions.re_run_workflow, repo=repo, run_id=run['id'])
+        else:
+            api.actions.re_run_workflow(repo=repo, run_id=run['id'])
+    except Exception as e:
+        return f'failed: {e}'
+
+    return 'rerun requested'
 
-def rerun_all_worflows_for_assignment(api, org, assignment_name:str,
-                                      workflow_filename: str='main.yml'):
+def rerun_all_workflows_for_assignment(api, org, assignment_name:str,
+                                       workflow_filename: str='main.yml',
+                                       max_workers: int=8, scheduler=None,
+                                       repos: list=None, discovery: str='list'):
     """Rerun all workflows for a given assignment.
 
+    The workflows are re-run concurrently by up to `max_workers` threads.
+    All requests are made with `api`, so any object implementing the same
+    interface, e.g. `replay.ReplayGhApi`, can be used.
+
     Parameters
     ----------
     api : object
@@ -275,33 +1316,105 @@ def rerun_all_worflows_for_assignment(api, org, assignment_name:str,
         Name of the assignment.
     workflow_filename : str, optional
         Name of the workflow file, by default 'main.yml'.
+    max_workers : int, optional
+        The maximum number of concurrent re-runs, by default 8.
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Github's rate limits. By
+        default one allowing `max_workers` concurrent requests is used.
+    repos : list, optional
+        The repositories to re-run. By default they are discovered with
+        `discover_repos` and assigned by prefix with `partition_repos`.
+    discovery : str, optional
+        The `discover_repos` backend, either ``'list'`` or ``'search'``, by
+        default 'list'.
 
     Returns
     -------
-    None
+    dict
+        A mapping of repository names to the outcome of their re-run, see
+        `rerun_latest_workflow`.
     """
-    repos = filter_repos(gh_api, org, assignment_name)
+    if repos is None:
+        repos = discover_repos(api, org, assignment_name, backend=discovery)
+        # Substring matches of hw1 also find hw10 repos
+        repos = partition_repos(repos, [assignment_name])[assignment_name]
 
-    for repo in repos:
-        rerun_latest_workflow(api, repo, workflow_filename)
+    if scheduler is None:
+        scheduler = RequestScheduler(max_concurrency=max_workers)
 
-    return
+    def rerun(repo):
+        return rerun_latest_workflow(api, repo, workflow_filename, scheduler)
 
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(repos, executor.map(rerun, repos)))
 
-def read_username_map(creditials:str=None, classname:str=None):
-    """Read username map from either a csv file or a Google sheet.
+# Misspelled name kept for backwards compatibility
+rerun_all_worflows_for_assignment = rerun_all_workflows_for_assignment
+
+def benchmark_rerun(fixture_file: str, assignment_name: str,
+                    workflow_filename: str='main.yml', max_workers: int=8,
+                    latency_scale: float=1.0):
+    """Measure the API calls and wall time of re-running an assignment against a recorded fixture.
+
+    No request is sent to Github; the fixture is replayed by
+    `replay.ReplayGhApi` with its recorded latencies.
 
     Parameters
     ----------
-    creditials : str, optional
+    fixture_file : str
+        Path of the recorded fixture.
+    assignment_name : str
+        Name of the assignment.
+    workflow_filename : str, optional
+        Name of the workflow file, by default 'main.yml'.
+    max_workers : int, optional
+        The maximum number of concurrent re-runs, by default 8.
+    latency_scale : float, optional
+        Factor applied to every recorded latency, by default 1.0.
+
+    Returns
+    -------
+    dict
+        ``repos`` is the number of repos re-run, ``calls`` the total number
+        of API calls, ``calls_by_endpoint`` their breakdown and
+        ``wall_time`` the elapsed seconds.
+    """
+    if __package__:
+        from .replay import ReplayGhApi
+    else:
+        # Run as the grader.py script, next to replay.py or with the package installed
+        try:
+            from replay import ReplayGhApi
+        except ImportError:
+            from github_canvas_grader.replay import ReplayGhApi
+
+    api = ReplayGhApi.from_file(fixture_file, latency_scale)
+
+    start = time.perf_counter()
+    outcomes = rerun_all_workflows_for_assignment(api, api.org, assignment_name,
+                                                  workflow_filename, max_workers)
+    wall_time = time.perf_counter() - start
+
+    return {'repos': len(outcomes),
+            'calls': api.total_calls,
+            'calls_by_endpoint': dict(api.calls),
+            'wall_time': wall_time}
+
+
+def read_username_map(creditials:str=None, classname:str=None):
+    """Read username map from either a csv file or a Google sheet.
+
+    Parameters
+    ----------
+    creditials : str, optional
         Creditials for accessing the Google sheet.
     classname : str, optional
         Name of the Google sheet.
 
     Returns
     -------
-    pandas.DataFrame
-        DataFrame containing the username map.
+    UsernameMap
+        The username map. Duplicates and conflicts found in it are printed.
 
     Raises
     ------
@@ -309,45 +1422,352 @@ def read_username_map(creditials:str=None, classname:str=None):
         If an error occurs while reading the Google sheet.
     """
     if os.path.isfile('username_map.csv'):
-        df = pd.read_csv('username_map.csv')
-        df['EID'] = df['EID'].convert_dtypes('str').apply(lambda s: s.lower())
-        df['Github Username'] = df['Github Username'].convert_dtypes('str').apply(lambda s: s.lower())
-        return df.set_index(['Github Username'])
+        username_map = UsernameMap.from_csv('username_map.csv')
     elif creditials is not None and classname is not None:
         try:
-            return username_map_from_google_sheet(creditials, classname)
+            username_map = username_map_from_google_sheet(
+                creditials, classname, cache_file=cache_path('username_map.pickle'))
         except ValueError:
             print("Error reading Google Sheet")
+            return
     else:
         print('You must specify a username map from a file name "username_map.csv" or Google sheet.')
+        return
+
+    username_map.report()
+    return username_map
+
+TIME_ZONE_NAMES = {'CST': 'America/Chicago', 'CDT': 'America/Chicago'}
+
+@lru_cache(maxsize=None)
+def resolve_timezone(name: str):
+    """
+    Resolve a time zone abbreviation or name once and cache the result.
+
+    Parameters
+    ----------
+    name : str
+        A time zone abbreviation such as 'CST' or an IANA name such as
+        'America/Chicago'.
+
+    Returns
+    -------
+    datetime.tzinfo
+        The time zone, or None if it is unknown.
+    """
+    from dateutil.tz import gettz
+
+    return gettz(TIME_ZONE_NAMES.get(name, name))
+
+class DuePolicy:
+    """
+    A due date and the score multiplier of submissions committed by then.
+
+    The due date is parsed once; commit times are compared to it as aware
+    datetimes, one at a time with `multiplier_for` or in bulk by calling
+    the policy with a Series of datetimes or an array of epoch seconds.
+
+    Parameters
+    ----------
+    due_time : datetime.datetime, optional
+        The timezone-aware due date. Without a due date every multiplier is 1.0.
+    multiplier : float, optional
+        The multiplier of submissions committed on or before the due date,
+        by default 1.0.
+    """
+
+    def __init__(self, due_time=None, multiplier: float=1.0):
+        self.due_time = due_time
+        self.multiplier = float(multiplier)
+        self.due_epoch = due_time.timestamp() if due_time is not None else None
+
+    @classmethod
+    def from_args(cls, args: dict):
+        """
+        Build the policy from the ``--due`` command line arguments.
+
+        Parameters
+        ----------
+        args : dict
+            A dictionary of command line arguments.
+
+        Returns
+        -------
+        DuePolicy
+            The policy, without a due date if ``--due`` is not given.
+        """
+        import dateutil.parser
+
+        if not args.get('--due'):
+            return cls()
+        time_zone = resolve_timezone(args['<TIME_ZONE>'])
+        if time_zone is None:
+            raise ValueError(f"Unknown time zone: {args['<TIME_ZONE>']}")
+        due_time = dateutil.parser.parse(f'{args["<DATE>"]} {args["<TIME>"]}')
+        return cls(due_time.replace(tzinfo=time_zone), args['<MULTIPLIER>'])
+
+    def multiplier_for(self, commit_time, comparison_operator=lambda a,b: a <= b):
+        """
+        Calculate the score multiplier of a single commit.
+
+        Parameters
+        ----------
+        commit_time : str or datetime.datetime
+            The commit time.
+        comparison_operator : callable, optional
+            Compares the seconds elapsed from the due date to the commit with 0,
+            by default ``a <= b``.
+
+        Returns
+        -------
+        float
+            The score multiplier.
+        """
+        import dateutil.parser
+
+        if self.due_time is None:
+            return 1.0
+        if isinstance(commit_time, str):
+            commit_time = dateutil.parser.parse(commit_time)
+        if comparison_operator((commit_time - self.due_time).total_seconds(), 0):
+            return self.multiplier
+        return 1.0
+
+    def __call__(self, commit_times):
+        """
+        Calculate the score multipliers of many commits.
+
+        Parameters
+        ----------
+        commit_times : pandas.Series or numpy.ndarray
+            Timezone-aware commit times, or commit times in epoch seconds.
+
+        Returns
+        -------
+        numpy.ndarray
+            The score multipliers.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if not isinstance(commit_times, pd.Series):
+            commit_times = np.asarray(commit_times)
+        if self.due_time is None:
+            return np.ones(len(commit_times))
+        if pd.api.types.is_numeric_dtype(commit_times):
+            on_time = np.asarray(commit_times) <= self.due_epoch
+        else:
+            on_time = np.asarray(commit_times <= self.due_time)
+        return np.where(on_time, self.multiplier, 1.0)
+
+@lru_cache(maxsize=128)
+def _due_policy(date: str, time_: str, time_zone: str, multiplier: str):
+    return DuePolicy.from_args({'--due': True, '<DATE>': date, '<TIME>': time_,
+                                '<TIME_ZONE>': time_zone, '<MULTIPLIER>': multiplier})
 
 def score_multiplier(args,
                      commit_time,
                      comparison_operator=lambda a,b: a <= b):
     """Calculate a score multiplier based on the commit time and due time.
 
+    The due date is parsed once per distinct ``--due`` arguments, see `DuePolicy`.
+
     Args:
         args (dict): A dictionary of command line arguments.
         commit_time (str): The commit time as a string.
-        comparison_operator (function, optional): A comparison operator to use for the calculation. Defaults to lambda a,b: a <= b.
+        comparison_operator (function, optional): A comparison operator applied to the seconds elapsed from the due time to the commit time and 0. Defaults to lambda a,b: a <= b.
 
     Returns:
         float: The score multiplier.
     """
     if args['--due']:
-        commit_time = dateutil.parser.parse(commit_time)
-        date_time_string = f'{args["<DATE>"]} {args["<TIME>"]} {args["<TIME_ZONE>"]}'
-        due_time = dateutil.parser.parse(date_time_string, tzinfos={"CST": gettz("America/Chicago")})
-        rel_time = dateutil.relativedelta.relativedelta(commit_time, due_time)
-        if (comparison_operator(rel_time.hours, 0) and
-            comparison_operator(rel_time.minutes, 0) and
-            comparison_operator(rel_time.seconds, 0)):
-            return float(args['<MULTIPLIER>'])
-        else:
-            return 1.0
+        policy = _due_policy(args['<DATE>'], args['<TIME>'], args['<TIME_ZONE>'],
+                             args['<MULTIPLIER>'])
+        return policy.multiplier_for(commit_time, comparison_operator)
     else:
         return 1.0
 
+SECONDS_PER_DAY = 86400.0
+
+def read_extensions(path: str):
+    """
+    Read a table of per-student deadline extensions from a csv file.
+
+    The file has an ``EID`` column and an ``Extension Days`` column; the
+    number of days may be fractional.
+
+    Parameters
+    ----------
+    path : str
+        Path of the csv file.
+
+    Returns
+    -------
+    pandas.Series
+        The extensions in seconds indexed by lowercase EID.
+    """
+    import pandas as pd
+
+    df = pd.read_csv(path)
+    eids = df['EID'].astype(str).str.lower()
+    return pd.Series(df['Extension Days'].astype(float).to_numpy() * SECONDS_PER_DAY,
+                     index=eids).groupby(level=0).max()
+
+class LatePolicy:
+    """
+    A tiered late-penalty policy evaluated in bulk over all submissions.
+
+    A commit gets the multiplier of the first deadline it meets. Commits
+    after the last deadline lose `daily_penalty` per started day late, either
+    linearly or compounded, down to `floor`, and get 0 after `cutoff_days`.
+    Every deadline is moved back by the grace window and by the student's
+    extension, if any.
+
+    Parameters
+    ----------
+    deadlines : list
+        ``(due_time, multiplier)`` pairs of timezone-aware datetimes and
+        multipliers, in any order.
+    daily_penalty : float, optional
+        Penalty per started day after the last deadline, by default 0.
+    decay : str, optional
+        ``'linear'`` subtracts `daily_penalty` from the multiplier of the last
+        deadline per day, ``'exponential'`` multiplies it by
+        ``1 - daily_penalty`` per day. By default 'linear'.
+    floor : float, optional
+        Smallest multiplier of a late commit before the cutoff, by default 0.
+    cutoff_days : float, optional
+        Days after the last deadline from which commits get 0, by default never.
+    grace : float, optional
+        Grace window in seconds added to every deadline, by default 0.
+    extensions : pandas.Series, optional
+        Extensions in seconds indexed by lowercase EID, see `read_extensions`.
+    """
+
+    def __init__(self, deadlines: list, daily_penalty: float=0.0, decay: str='linear',
+                 floor: float=0.0, cutoff_days: float=None, grace: float=0.0,
+                 extensions=None):
+        import numpy as np
+        import pandas as pd
+
+        if not deadlines:
+            raise ValueError("A late policy needs at least one deadline")
+        if decay not in ('linear', 'exponential'):
+            raise ValueError(f"Unknown decay: {decay}")
+        deadlines = sorted(deadlines, key=lambda deadline: deadline[0])
+        self.deadlines = deadlines
+        self.due_epochs = np.array([due_time.timestamp() for due_time, _ in deadlines])
+        self.multipliers = np.array([float(multiplier) for _, multiplier in deadlines])
+        self.daily_penalty = float(daily_penalty)
+        self.decay = decay
+        self.floor = float(floor)
+        self.cutoff_days = cutoff_days
+        self.grace = float(grace)
+        self.extensions = extensions if extensions is not None else pd.Series(dtype=float)
+
+    @classmethod
+    def from_file(cls, path: str):
+        """
+        Load a policy from a JSON file.
+
+        The file looks like::
+
+            {
+              "time_zone": "CST",
+              "deadlines": [{"due": "2023-02-01 23:59:59", "multiplier": 1.1},
+                            {"due": "2023-02-03 23:59:59", "multiplier": 1.0}],
+              "daily_penalty": 0.1,
+              "decay": "linear",
+              "floor": 0.5,
+              "cutoff_days": 7,
+              "grace_minutes": 15,
+              "extensions": "extensions.csv"
+            }
+
+        where the extensions file, relative to the policy file, is read with
+        `read_extensions`. Only ``deadlines`` is required.
+
+        Parameters
+        ----------
+        path : str
+            Path of the JSON file.
+
+        Returns
+        -------
+        LatePolicy
+            The policy.
+        """
+        import dateutil.parser
+
+        with open(path) as f:
+            config = json.load(f)
+
+        time_zone = resolve_timezone(config.get('time_zone', 'UTC'))
+        if time_zone is None:
+            raise ValueError(f"Unknown time zone: {config['time_zone']}")
+        deadlines = list()
+        for deadline in config['deadlines']:
+            due_time = dateutil.parser.parse(deadline['due'])
+            if due_time.tzinfo is None:
+                due_time = due_time.replace(tzinfo=time_zone)
+            deadlines.append((due_time, deadline.get('multiplier', 1.0)))
+
+        extensions = None
+        if config.get('extensions'):
+            extensions = read_extensions(os.path.join(os.path.dirname(path),
+                                                      config['extensions']))
+
+        return cls(deadlines, daily_penalty=config.get('daily_penalty', 0.0),
+                   decay=config.get('decay', 'linear'), floor=config.get('floor', 0.0),
+                   cutoff_days=config.get('cutoff_days'),
+                   grace=60.0 * config.get('grace_minutes', 0.0), extensions=extensions)
+
+    def __call__(self, commit_times, eids=None):
+        """
+        Calculate the score multipliers of many commits.
+
+        Parameters
+        ----------
+        commit_times : pandas.Series or numpy.ndarray
+            Timezone-aware commit times, or commit times in epoch seconds.
+        eids : pandas.Series or list, optional
+            The lowercase EIDs of the committers, aligned with `commit_times`,
+            used to look up extensions.
+
+        Returns
+        -------
+        numpy.ndarray
+            The score multipliers.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if isinstance(commit_times, pd.Series) and not pd.api.types.is_numeric_dtype(commit_times):
+            epochs = (commit_times - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+        else:
+            epochs = np.asarray(commit_times, dtype=float)
+
+        shift = np.full(len(epochs), self.grace)
+        if eids is not None and len(self.extensions):
+            shift += pd.Series(np.asarray(eids, dtype=object)).map(self.extensions) \
+                .fillna(0.0).to_numpy(dtype=float)
+        effective = epochs - shift
+
+        tier = np.searchsorted(self.due_epochs, effective, side='left')
+        on_time = tier < len(self.due_epochs)
+        multipliers = self.multipliers[np.minimum(tier, len(self.due_epochs) - 1)]
+
+        days_late = np.ceil((effective - self.due_epochs[-1]) / SECONDS_PER_DAY)
+        if self.decay == 'linear':
+            late = self.multipliers[-1] - self.daily_penalty * days_late
+        else:
+            late = self.multipliers[-1] * (1 - self.daily_penalty) ** days_late
+        late = np.maximum(late, self.floor)
+        if self.cutoff_days is not None:
+            late = np.where(days_late > self.cutoff_days, 0.0, late)
+
+        return np.where(on_time, multipliers, late)
+
 def get_assignment_id(course, assignment_name:str):
     """
     Retrieve the assignment id of a given assignment name from a course.
@@ -375,72 +1795,952 @@ def get_assignment_id(course, assignment_name:str):
     print(f"No assignment id with corresponding name: {assignment_name}")
     return
 
+def cache_path(filename: str):
+    """
+    Return the path of a cache file inside the grader's cache directory.
 
-if __name__ == '__main__':
+    The cache directory is given by the ``GRADER_CACHE_DIR`` environment
+    variable and is created if it does not exist.
 
-    args = docopt(__doc__, version='grader 0.2.0')
+    Parameters
+    ----------
+    filename : str
+        Name of the cache file.
 
-    if args['--encode']:
-        print(google_creditial_encoder(args['<google_client_secret.json>']))
-        exit()
+    Returns
+    -------
+    str
+        The full path of the cache file.
+    None
+        If ``GRADER_CACHE_DIR`` is not set.
+    """
+    cache_dir = os.environ.get('GRADER_CACHE_DIR')
+
+    if not cache_dir:
+        return None
 
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, filename)
 
-    if args['--env']:
-        for name, value in zip(args['<NAME>'], args['<VALUE>']):
-            os.environ[name] = value
+class AssignmentResolver:
+    """
+    Resolve assignment names to Canvas assignments for a course.
 
-    verbose = True
+    The course's assignment list is read at most once per run and kept as a
+    name to id index. Resolved Assignment objects are cached for the rest of
+    the run. If `index_file` is given, the index is also stored on disk so
+    later runs can skip listing the course's assignments entirely.
 
-    org = os.environ['GITHUB_REPOSITORY'].split('/')[0]
+    Parameters
+    ----------
+    course : canvasapi.course.Course
+        The course to resolve assignments in.
+    index_file : str, optional
+        Path of a JSON file used to persist the name to id index.
+    """
 
-    gh_api = GhApi(owner=org,
-                   token=os.environ['GH_TOKEN'])
+    def __init__(self, course, index_file: str=None):
+        self.course = course
+        self.index_file = index_file
+        self.index = self._load_index()
+        self.assignments = dict()
+        self.refreshed = False
+
+    def _load_index(self):
+        if self.index_file is None or not os.path.isfile(self.index_file):
+            return dict()
+
+        with open(self.index_file) as f:
+            return json.load(f).get(str(self.course.id), dict())
+
+    def _save_index(self):
+        if self.index_file is None:
+            return
+
+        indexes = dict()
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                indexes = json.load(f)
+
+        indexes[str(self.course.id)] = self.index
+        with open(self.index_file, 'w') as f:
+            json.dump(indexes, f)
+
+    def refresh(self):
+        """Rebuild the name to id index from a single pass over the course's assignments."""
+        self.index = {assignment.name: assignment.id
+                      for assignment in self.course.get_assignments()}
+        self.refreshed = True
+        self._save_index()
+
+    def get_assignment_id(self, assignment_name: str):
+        """
+        Retrieve the id of an assignment by name.
+
+        Parameters
+        ----------
+        assignment_name : str
+            The name of the assignment.
+
+        Returns
+        -------
+        int
+            The id of the assignment with the given name.
+            None if no assignment with the given name is found.
+        """
+        if assignment_name not in self.index:
+            self.refresh()
+
+        if assignment_name not in self.index:
+            print(f"No assignment id with corresponding name: {assignment_name}")
+
+        return self.index.get(assignment_name)
+
+    def get_assignment(self, assignment_name: str):
+        """
+        Retrieve an assignment by name, resolving it only once per run.
+
+        Parameters
+        ----------
+        assignment_name : str
+            The name of the assignment.
+
+        Returns
+        -------
+        canvasapi.assignment.Assignment
+            The assignment with the given name.
+            None if no assignment with the given name is found.
+        """
+        from canvasapi.exceptions import ResourceDoesNotExist
+
+        if assignment_name in self.assignments:
+            return self.assignments[assignment_name]
+
+        assignment_id = self.get_assignment_id(assignment_name)
+        if assignment_id is None:
+            return None
 
-    if args['--trigger']:
-        rerun_all_worflows_for_assignment(gh_api, org, args["<assignment_name>"])
-        exit()
+        try:
+            assignment = self.course.get_assignment(assignment_id)
+        except ResourceDoesNotExist:
+            # The persisted index is stale, e.g. the assignment was recreated
+            self.refresh()
+            assignment_id = self.index.get(assignment_name)
+            if assignment_id is None:
+                return None
+            assignment = self.course.get_assignment(assignment_id)
+
+        self.assignments[assignment_name] = assignment
+        return assignment
+
+    def expand(self, patterns: list):
+        """
+        Expand assignment names and glob patterns into assignment names.
+
+        Patterns containing ``*``, ``?`` or ``[`` are matched against the
+        names of the course's assignments; other names are kept as they are.
+        The index is refreshed once before the first pattern is matched, so
+        assignments created since it was persisted are not missed.
+
+        Parameters
+        ----------
+        patterns : list
+            Assignment names or glob patterns.
+
+        Returns
+        -------
+        list
+            The assignment names in order, without repetitions.
+        """
+        names = list()
+        for pattern in patterns:
+            if not any(char in pattern for char in '*?['):
+                names.append(pattern)
+                continue
+            if not self.refreshed:
+                self.refresh()
+            matches = sorted(fnmatch.filter(self.index, pattern))
+            if not matches:
+                print(f"No assignments match {pattern}")
+            names.extend(matches)
+
+        return list(dict.fromkeys(names))
+
+class RosterCache:
+    """
+    Map student EIDs to Canvas user ids for a course.
 
-    canvas = Canvas('https://utexas.instructure.com',
-                    os.environ['CANVAS_TOKEN'])
+    The course's student enrollments are read in a single paginated sweep and
+    kept in memory keyed by lowercase EID (the Canvas SIS login id), so that
+    per-student lookups need no network call. If `cache_file` is given, the
+    roster is also stored on disk and reused by later runs until it is older
+    than `ttl` seconds.
 
-    course = canvas.get_course(os.environ['CANVAS_COURSE_ID'])
+    Parameters
+    ----------
+    course : canvasapi.course.Course
+        The course to read the roster of.
+    cache_file : str, optional
+        Path of a JSON file used to persist the roster.
+    ttl : float, optional
+        Maximum age in seconds of a persisted roster, by default one day.
+    """
 
-    username_map = read_username_map(os.environ['GOOGLE_CLIENT_SECRET'], org)
+    def __init__(self, course, cache_file: str=None, ttl: float=86400.0):
+        self.course = course
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.users = self._load()
+
+    def _load(self):
+        if self.cache_file is not None and os.path.isfile(self.cache_file):
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+            if (cached.get('course_id') == str(self.course.id) and
+                time.time() - cached.get('saved_at', 0) < self.ttl):
+                return cached['users']
+
+        return self.refresh()
+
+    def _save(self):
+        if self.cache_file is None:
+            return
+
+        with open(self.cache_file, 'w') as f:
+            json.dump({'course_id': str(self.course.id),
+                       'saved_at': time.time(),
+                       'users': self.users}, f)
+
+    def refresh(self):
+        """
+        Re-read the roster from the course's student enrollments.
+
+        Returns
+        -------
+        dict
+            A mapping of lowercase EIDs to Canvas user ids.
+        """
+        self.users = dict()
+        for enrollment in self.course.get_enrollments(type=['StudentEnrollment']):
+            login_id = enrollment.user.get('login_id')
+            if login_id:
+                self.users[str(login_id).lower()] = enrollment.user_id
+
+        self._save()
+        return self.users
+
+    def canvas_id_for(self, eid: str):
+        """
+        Retrieve the Canvas user id of a student.
+
+        Students missing from the roster, e.g. because they enrolled after it
+        was read, are looked up individually and added to the roster.
+
+        Parameters
+        ----------
+        eid : str
+            The EID of the student.
+
+        Returns
+        -------
+        int
+            The Canvas user id of the student.
+        """
+        eid = str(eid).lower()
+
+        if eid not in self.users:
+            self.users[eid] = self.course.get_user(eid, 'sis_login_id').id
+            self._save()
+
+        return self.users[eid]
+
+class GradeStateStore:
+    """
+    Record the workflow run and score last uploaded for each repository.
 
-    repos = filter_repos(gh_api, org, args["<assignment_name>"])
+    The state is kept in a SQLite database so that reruns of the grader can
+    skip repositories whose latest workflow run and computed score have not
+    changed since their grade was last posted to Canvas.
 
-    print(f"Grading: {args['<assignment_name>']}")
-    print('Found repos:')
-    for repo in repos:
-        print(f'    {repo}')
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file, created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS grades ('
+                'assignment TEXT NOT NULL, repo TEXT NOT NULL, run_id INTEGER, '
+                'commit_time TEXT, conclusion TEXT, score REAL, graded_at REAL, '
+                'PRIMARY KEY (assignment, repo))')
+
+    def get(self, assignment_name: str, repo: str):
+        """
+        Retrieve the last recorded state of a repository.
+
+        Parameters
+        ----------
+        assignment_name : str
+            The name of the assignment.
+        repo : str
+            The repository name.
+
+        Returns
+        -------
+        dict
+            The recorded ``run_id``, ``commit_time``, ``conclusion`` and ``score``.
+        None
+            If no grade was recorded for the repository.
+        """
+        row = self.connection.execute(
+            'SELECT run_id, commit_time, conclusion, score FROM grades '
+            'WHERE assignment = ? AND repo = ?', (assignment_name, repo)).fetchone()
+
+        if row is None:
+            return None
+        else:
+            return dict(zip(('run_id', 'commit_time', 'conclusion', 'score'), row))
+
+    def is_unchanged(self, assignment_name: str, repo: str, run_id, commit_time: str,
+                     conclusion: str, score: float):
+        """
+        Check whether a repository's run and score match the last uploaded grade.
+
+        Returns
+        -------
+        bool
+            True if the same run was already graded with the same score. Runs
+            without an id never match.
+        """
+        if run_id is None:
+            return False
+        return self.get(assignment_name, repo) == {'run_id': run_id,
+                                                   'commit_time': commit_time,
+                                                   'conclusion': conclusion,
+                                                   'score': score}
+
+    def record(self, assignment_name: str, repo: str, run_id, commit_time: str,
+               conclusion: str, score: float):
+        """Record that a repository's grade was uploaded."""
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO grades VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (assignment_name, repo, run_id, commit_time, conclusion, score,
+                 time.time()))
+
+    def summary(self):
+        """
+        Summarize the recorded grades of every assignment.
+
+        Returns
+        -------
+        list
+            One dictionary per assignment with its name, the number of graded
+            ``repos``, their ``mean_score`` and the time ``last_graded_at``.
+        """
+        rows = self.connection.execute(
+            'SELECT assignment, COUNT(*), AVG(score), MAX(graded_at) FROM grades '
+            'GROUP BY assignment ORDER BY assignment').fetchall()
+        return [dict(zip(('assignment', 'repos', 'mean_score', 'last_graded_at'), row))
+                for row in rows]
+
+    def records(self, assignment_name: str):
+        """
+        Retrieve the recorded grades of an assignment.
+
+        Returns
+        -------
+        list
+            One dictionary per repository with its ``repo``, ``run_id``,
+            ``commit_time``, ``conclusion``, ``score`` and ``graded_at``.
+        """
+        rows = self.connection.execute(
+            'SELECT repo, run_id, commit_time, conclusion, score, graded_at FROM grades '
+            'WHERE assignment = ? ORDER BY repo', (assignment_name,)).fetchall()
+        return [dict(zip(('repo', 'run_id', 'commit_time', 'conclusion', 'score',
+                          'graded_at'), row)) for row in rows]
+
+    def close(self):
+        """Close the database connection."""
+        self.connection.close()
+
+def wait_for_progress(progress, poll_interval: float=1.0, timeout: float=300.0):
+    """
+    Poll a Canvas Progress object until its job completes or fails.
 
+    Parameters
+    ----------
+    progress : canvasapi.progress.Progress
+        The Progress object returned by an asynchronous Canvas call.
+    poll_interval : float, optional
+        Maximum number of seconds to wait between polls, by default 1.0.
+        Polling starts at a tenth of this and doubles up to it, so that
+        short jobs are not held up by a full interval.
+    timeout : float, optional
+        Maximum number of seconds to wait, by default 300.0.
+
+    Returns
+    -------
+    canvasapi.progress.Progress
+        The final state of the Progress object.
+
+    Raises
+    ------
+    TimeoutError
+        If the job has not finished within `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    delay = poll_interval / 10
+    while progress.workflow_state not in ('completed', 'failed'):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Canvas job {progress.id} did not finish "
+                               f"within {timeout} seconds")
+        time.sleep(delay)
+        delay = min(2 * delay, poll_interval)
+        progress = progress.query()
+
+    return progress
+
+def upload_grades_in_bulk(assignment, grades: dict, batch_size: int=100,
+                          poll_interval: float=1.0, timeout: float=300.0,
+                          scheduler=None):
+    """
+    Upload grades for many students with Canvas bulk update_grades calls.
+
+    Grades are posted in batches of `batch_size` students. If the Canvas job
+    for a batch fails, the batch is split in half and retried until the
+    failure is isolated to individual students. If the request itself fails,
+    every student of the batch is reported as failed without splitting it,
+    and authentication errors are raised.
+
+    Parameters
+    ----------
+    assignment : canvasapi.assignment.Assignment
+        The assignment to post grades to.
+    grades : dict
+        A mapping of Canvas user ids to scores.
+    batch_size : int, optional
+        Number of students per bulk update call, by default 100.
+    poll_interval : float, optional
+        Seconds to wait between Progress polls, by default 1.0.
+    timeout : float, optional
+        Maximum number of seconds to wait on each job, by default 300.0.
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Canvas's rate limits.
+
+    Returns
+    -------
+    dict
+        A mapping of Canvas user ids to error messages for every student
+        whose grade could not be posted. Empty if all grades were posted.
+
+    Raises
+    ------
+    canvasapi.exceptions.CanvasException
+        If Canvas rejects the token.
+    """
+    from canvasapi.exceptions import Forbidden, InvalidAccessToken, Unauthorized
+
+    failures = dict()
+
+    def post(batch):
+        grade_data = {canvas_id: {'posted_grade': score}
+                      for canvas_id, score in batch}
+        try:
+            if scheduler is not None:
+                progress = scheduler.canvas(assignment.submissions_bulk_update,
+                                            grade_data=grade_data)
+            else:
+                progress = assignment.submissions_bulk_update(grade_data=grade_data)
+            progress = wait_for_progress(progress, poll_interval, timeout)
+        except (Forbidden, InvalidAccessToken, Unauthorized):
+            raise
+        except Exception as e:
+            # Splitting cannot isolate a failure that is not about the grades
+            failures.update((canvas_id, str(e)) for canvas_id, _ in batch)
+            return
+
+        if progress.workflow_state == 'completed':
+            return
+        message = getattr(progress, 'message', None) or 'Canvas job failed'
+        if len(batch) == 1:
+            failures[batch[0][0]] = message
+        else:
+            middle = len(batch) // 2
+            post(batch[:middle])
+            post(batch[middle:])
+
+    items = list(grades.items())
+    for start in range(0, len(items), batch_size):
+        post(items[start:start + batch_size])
+
+    return failures
+
+
+def runs_to_frame(runs: dict):
+    """
+    Tabulate the latest workflow run of each repository.
+
+    Parameters
+    ----------
+    runs : dict
+        A mapping of repository names to their latest workflow runs, see
+        `fetch_latest_workflow_runs`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per repository with the columns ``repo``, ``run_id``,
+        ``github_username``, ``commit_time`` and ``conclusion``. Repositories
+        without runs have missing run ids, commit times and conclusions.
+    """
+    import pandas as pd
+
+    present = [run is not None for run in runs.values()]
+    frame = pd.DataFrame({
+        'repo': pd.Series(list(runs), dtype=object),
+        'run_id': pd.array([run['id'] if run is not None else None
+                            for run in runs.values()], dtype='Int64'),
+        'commit_time': pd.Series([run['head_commit']['timestamp'] if ok else None
+                                  for run, ok in zip(runs.values(), present)], dtype=object),
+        'conclusion': pd.Series([run['conclusion'] if ok else None
+                                 for run, ok in zip(runs.values(), present)], dtype=object)})
+    # Vectorized `strip_github_username`
+    frame.insert(2, 'github_username',
+                 frame['repo'].str.split('-', n=1).str[1].fillna('').str.lower())
+    return frame
+
+def score_runs(frame, username_map, multiplier=None):
+    """
+    Score a table of workflow runs with vectorized operations.
+
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        The runs, with at least the columns ``github_username``,
+        ``commit_time`` and ``conclusion``, see `runs_to_frame`.
+    username_map : UsernameMap
+        Map of lowercase Github usernames to EIDs, see `read_username_map`.
+    multiplier : callable, optional
+        Function mapping a Series of timezone-aware commit times to an array
+        of score multipliers, by default always 1.0. A `LatePolicy` is also
+        passed the EIDs of the committers.
+
+    Returns
+    -------
+    pandas.DataFrame
+        `frame` with the added columns ``eid`` (missing if the username is
+        not in the map), ``commit_timestamp`` (the parsed commit time in UTC)
+        and ``score`` (1 times the multiplier for successful runs, 0 for
+        failed runs and missing for any other conclusion).
+    """
+    import numpy as np
+    import pandas as pd
+
+    eids = as_username_map(username_map).to_series().rename('eid')
+    scored = frame.merge(eids, how='left', left_on='github_username', right_index=True)
+
+    scored['commit_timestamp'] = pd.to_datetime(scored['commit_time'], utc=True,
+                                                errors='coerce')
+
+    success = (scored['conclusion'] == 'success').to_numpy()
+    failure = (scored['conclusion'] == 'failure').to_numpy()
+    scores = np.where(failure, 0.0, np.nan)
+    if multiplier is None:
+        scores[success] = 1.0
+    elif success.any():
+        commit_times = scored.loc[success, 'commit_timestamp']
+        if isinstance(multiplier, LatePolicy):
+            multipliers = multiplier(commit_times, eids=scored.loc[success, 'eid'])
+        else:
+            multipliers = multiplier(commit_times)
+        scores[success] = 1 * np.asarray(multipliers, dtype=float)
+    scored['score'] = scores
+
+    return scored
+
+def partition_repos(repos: list, assignment_names: list):
+    """
+    Partition repository names by the assignment they belong to.
+
+    A repository belongs to the assignment whose name, followed by a dash,
+    is the longest prefix of the repository name, so that ``hw10-alice``
+    belongs to ``hw10`` rather than ``hw1``.
+
+    Parameters
+    ----------
+    repos : list
+        The repository names.
+    assignment_names : list
+        The assignment names.
+
+    Returns
+    -------
+    dict
+        A mapping of every assignment name to the list of its repositories.
+    """
+    partitions = {name: list() for name in assignment_names}
+    prefixes = sorted(assignment_names, key=len, reverse=True)
     for repo in repos:
+        for name in prefixes:
+            if repo.startswith(f'{name}-'):
+                partitions[name].append(repo)
+                break
 
-        commit_time, conclusion = \
-                        get_latest_workflow_commit_time_and_conclusion(gh_api,
-                                                                       repo,
-                                                                       workflow_filename='main.yml')
+    return partitions
 
-        if conclusion is not None:
-            github_username = strip_github_username(repo)
+def grade_runs(runs: dict, assignment_name: str, username_map, roster, assignment,
+               multiplier=None, scheduler=None, state=None, bulk: bool=False,
+               force: bool=False, verbose: bool=True, batch_size: int=100):
+    """
+    Score the latest workflow run of each repository and upload the grades to Canvas.
 
-            multiplier = score_multiplier(args, commit_time)
+    Parameters
+    ----------
+    runs : dict
+        A mapping of repository names to their latest workflow runs, see
+        `fetch_latest_workflow_runs`.
+    assignment_name : str
+        Name of the assignment.
+    username_map : UsernameMap
+        Map of lowercase Github usernames to EIDs, see `read_username_map`.
+    roster : RosterCache
+        The course roster.
+    assignment : canvasapi.assignment.Assignment
+        The assignment to post grades to.
+    multiplier : callable, optional
+        Function mapping a Series of commit times to score multipliers, see
+        `score_runs`. By default always 1.0.
+    scheduler : RequestScheduler, optional
+        A scheduler keeping the requests within Canvas's rate limits.
+    state : GradeStateStore, optional
+        Store of previously uploaded grades; unchanged grades are skipped.
+    bulk : bool, optional
+        Upload all grades with bulk update_grades calls, by default False.
+    force : bool, optional
+        Upload grades even if they are unchanged, by default False.
+    verbose : bool, optional
+        Print every updated grade, by default True.
+    batch_size : int, optional
+        Number of students per bulk update call, by default 100.
 
-            assignment = course.get_assignment(get_assignment_id(course,
-                                                                 args["<assignment_name>"]))
+    Returns
+    -------
+    dict
+        ``grades`` maps Canvas user ids to their computed scores and
+        ``failures`` maps the Canvas user ids whose upload failed to the error.
+    """
+    import pandas as pd
 
-            try:
-                eid = username_map.loc[github_username, "EID"]
-                canvas_id = course.get_user(eid, 'sis_login_id').id
-                submission = assignment.get_submission(canvas_id)
-                if conclusion == 'success':
-                    score = 1 * multiplier
-                elif conclusion == 'failure':
-                    score = 0
-                submission.edit(submission={'posted_grade': score})
+    if scheduler is None:
+        scheduler = RequestScheduler()
+
+    grades = dict()
+    pending = dict()
+    failures = dict()
+
+    username_map = as_username_map(username_map)
+    scored = score_runs(runs_to_frame(runs), username_map, multiplier)
+
+    for row in scored.itertuples(index=False):
+        repo = row.repo
+
+        if pd.isna(row.conclusion):
+            print(f"No workflow runs for {repo}")
+            continue
+        if pd.isna(row.score):
+            print(f"Not grading {repo}: workflow conclusion is {row.conclusion}")
+            continue
+
+        score = row.score
+        # Runs read from a GraphQL status check rollup have no id
+        run_id = None if pd.isna(row.run_id) else int(row.run_id)
+        graded = (assignment_name, repo, run_id, row.commit_time, row.conclusion, score)
+
+        if state is not None and not force and state.is_unchanged(*graded):
+            if verbose:
+                print(f"Unchanged since last upload: {repo}")
+            continue
+
+        canvas_id = None
+        try:
+            if pd.isna(row.eid):
+                # Raises a KeyError explaining whether the username is unknown or conflicting
+                username_map.eid_for(row.github_username)
+            canvas_id = roster.canvas_id_for(row.eid)
+            grades[canvas_id] = score
+            if bulk:
+                pending[canvas_id] = graded
+                continue
+            submission = scheduler.canvas(assignment.get_submission, canvas_id)
+            scheduler.canvas(submission.edit, submission={'posted_grade': score})
+            if state is not None:
+                state.record(*graded)
+            if verbose:
+                print(f"Updated grade: {canvas_id} = {score}")
+        except Exception as e:
+            if canvas_id is not None:
+                failures[canvas_id] = repr(e)
+            print(f"Failed to grade {repo}: {e!r}")
+
+    if bulk and pending:
+        bulk_failures = upload_grades_in_bulk(assignment, {canvas_id: grades[canvas_id]
+                                                           for canvas_id in pending},
+                                              batch_size=batch_size, scheduler=scheduler)
+        failures.update(bulk_failures)
+        for canvas_id in pending:
+            if canvas_id not in bulk_failures:
+                if state is not None:
+                    state.record(*pending[canvas_id])
                 if verbose:
-                    print(f"Updated grade: {canvas_id} = {score}")
-            except:
-                pass
+                    print(f"Updated grade: {canvas_id} = {grades[canvas_id]}")
+        for canvas_id, message in bulk_failures.items():
+            print(f"Failed to update grade: {canvas_id} ({message})")
+
+    return {'grades': grades, 'failures': failures}
+
+
+def grade_assignment(assignment_name: str, **kwargs):
+    """
+    Grade an assignment from its Github Actions results and upload the grades to Canvas.
+
+    This is the whole grading run of the command line tool for a single
+    assignment, see `grade_assignments` for the keyword arguments.
+
+    Parameters
+    ----------
+    assignment_name : str
+        Name of the assignment, used both to filter repos and to find the
+        Canvas assignment.
+    **kwargs
+        Keyword arguments of `grade_assignments`.
+
+    Returns
+    -------
+    dict
+        ``repos`` lists the repos found, ``grades`` maps Canvas user ids to
+        their computed scores and ``failures`` maps the Canvas user ids whose
+        upload failed to the error.
+    """
+    return grade_assignments([assignment_name], **kwargs)[assignment_name]
+
+def grade_assignments(assignment_names: list, *, org: str, github_token: str,
+                      canvas_token: str, course_id,
+                      canvas_url: str='https://utexas.instructure.com',
+                      github_url: str=None, username_map=None,
+                      google_creditials: str=None, workflow_filename: str='main.yml',
+                      multiplier=None, workers: int=8, graphql: bool=False,
+                      bulk: bool=False, batch_size: int=100, force: bool=False,
+                      discovery: str='list', metrics: Metrics=None, verbose: bool=True):
+    """
+    Grade several assignments in one run and upload the grades to Canvas.
+
+    The username map, the course's assignment index and roster are read
+    once and shared by all assignments. By default the organization's repos
+    are listed once; with the ``'search'`` discovery each assignment's repos
+    are searched for with `discover_repos`. Either way repos are assigned
+    by assignment prefix with `partition_repos`. The latest workflow runs of all repos are fetched
+    together and each assignment's grades are then uploaded separately.
+    Caches are kept in ``GRADER_CACHE_DIR`` if it is set, see `cache_path`.
+
+    Parameters
+    ----------
+    assignment_names : list
+        Assignment names or glob patterns matched against the names of the
+        course's assignments, see `AssignmentResolver.expand`.
+    org : str
+        The Github organization name.
+    github_token : str
+        The Github token.
+    canvas_token : str
+        The Canvas token.
+    course_id : int or str
+        The Canvas course id.
+    canvas_url : str, optional
+        The base URL of the Canvas instance, by default 'https://utexas.instructure.com'.
+    github_url : str, optional
+        The base URL of the Github API, by default ``GH_HOST`` or 'https://api.github.com'.
+    username_map : UsernameMap, optional
+        The username map, by default read with `read_username_map`.
+    google_creditials : str, optional
+        Encoded Google credentials used to read the username map from a Google sheet.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    multiplier : callable, optional
+        Function mapping a Series of commit times to score multipliers, e.g.
+        a `DuePolicy` or `LatePolicy`. By default always 1.0.
+    workers : int, optional
+        The maximum number of concurrent requests (default is 8).
+    graphql : bool, optional
+        Fetch the workflow runs with batched GraphQL queries, by default False.
+    bulk : bool, optional
+        Upload each assignment's grades with bulk update_grades calls, by default False.
+    batch_size : int, optional
+        Number of students per bulk update call, by default 100.
+    force : bool, optional
+        Upload grades even if they are unchanged, by default False.
+    discovery : str, optional
+        The `discover_repos` backend, either ``'list'`` or ``'search'``, by
+        default 'list'.
+    metrics : Metrics, optional
+        Metrics recording the time spent in each phase and API endpoint.
+    verbose : bool, optional
+        Print the repos found and every updated grade, by default True.
+
+    Returns
+    -------
+    dict
+        A mapping of assignment names to the result of `grade_assignment`.
+
+    Raises
+    ------
+    ValueError
+        If the username map could not be read.
+    """
+    from canvasapi import Canvas
+
+    if metrics is None:
+        metrics = Metrics()
+
+    gh_api = InstrumentedGhApi(owner=org, token=github_token, metrics=metrics,
+                               gh_host=github_url or os.environ.get('GH_HOST',
+                                                                    'https://api.github.com'))
+
+    course = Canvas(canvas_url, canvas_token).get_course(course_id)
+
+    scheduler = RequestScheduler(max_concurrency=workers)
+    scheduler.install_canvas_hook(course)
+    metrics.install_canvas_hook(course)
+
+    if username_map is None:
+        with metrics.phase('read_username_map'):
+            username_map = read_username_map(google_creditials, org)
+        if username_map is None:
+            raise ValueError('The username map could not be read')
+
+    with metrics.phase('canvas_lookups'):
+        assignments = AssignmentResolver(course, cache_path('assignments.json'))
+        assignment_names = assignments.expand(assignment_names)
+
+        roster = RosterCache(course, cache_path('roster.json'))
+
+    with metrics.phase('discover_repos'):
+        if discovery == 'search':
+            found = [repo for name in assignment_names
+                     for repo in discover_repos(gh_api, org, name, backend='search',
+                                                cache_file=cache_path('repos.json'))]
         else:
-            print(f"No workflow runs for {repo}")
+            found = filter_repos(gh_api, org, '', cache_file=cache_path('repos.json'))
+        # Substring matches of hw1 also find hw10 repos
+        repos = partition_repos(list(dict.fromkeys(found)), assignment_names)
+
+    state_file = cache_path('state.sqlite')
+    state = GradeStateStore(state_file) if state_file else None
+
+    results = dict()
+    try:
+        all_repos = [repo for name in assignment_names for repo in repos[name]]
+        with metrics.phase('fetch_workflow_runs'):
+            if graphql:
+                runs = fetch_latest_workflow_runs_graphql(gh_api, org, all_repos,
+                                                          workflow_filename=workflow_filename,
+                                                          scheduler=scheduler)
+            else:
+                runs = fetch_latest_workflow_runs(gh_api, all_repos,
+                                                  workflow_filename=workflow_filename,
+                                                  max_workers=workers,
+                                                  scheduler=scheduler)
+
+        for name in assignment_names:
+            if verbose:
+                print(f"Grading: {name}")
+                print('Found repos:')
+                for repo in repos[name]:
+                    print(f'    {repo}')
+
+            with metrics.phase('canvas_lookups'):
+                assignment = assignments.get_assignment(name)
+            if assignment is None:
+                print(f"Not grading {name}: no Canvas assignment with this name")
+                results[name] = {'repos': repos[name], 'grades': dict(), 'failures': dict()}
+                continue
+
+            with metrics.phase('grade_and_upload'):
+                result = grade_runs({repo: runs[repo] for repo in repos[name]}, name,
+                                    username_map, roster, assignment,
+                                    multiplier=multiplier, scheduler=scheduler, state=state,
+                                    bulk=bulk, force=force, verbose=verbose,
+                                    batch_size=batch_size)
+            results[name] = {'repos': repos[name], **result}
+    finally:
+        if state is not None:
+            state.close()
+
+    return results
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__, version='grader 0.2.0')
+
+    if args['--encode']:
+        print(google_creditial_encoder(args['<google_client_secret.json>']))
+        exit()
+
+
+    if args['--env']:
+        for name, value in zip(args['<NAME>'], args['<VALUE>']):
+            os.environ[name] = value
+
+    verbose = True
+
+    if args['--dry-run']:
+        report = benchmark_rerun(args['--dry-run'], args["<assignment_name>"],
+                                 max_workers=int(args['--workers']))
+        print(f"Dry run: re-running {report['repos']} repos takes "
+              f"{report['calls']} API calls in {report['wall_time']:.2f} s")
+        for endpoint, calls in report['calls_by_endpoint'].items():
+            print(f"    {endpoint}: {calls}")
+        exit()
+
+    org = os.environ['GITHUB_REPOSITORY'].split('/')[0]
+
+    metrics = Metrics()
+
+    def report_metrics():
+        if args['--metrics']:
+            metrics.print_summary()
+        if args['--metrics-file']:
+            metrics.write_json(args['--metrics-file'])
+
+    if args['--trigger']:
+        gh_api = InstrumentedGhApi(owner=org,
+                                   token=os.environ['GH_TOKEN'],
+                                   metrics=metrics)
+        with metrics.phase('rerun_workflows'):
+            outcomes = rerun_all_workflows_for_assignment(gh_api, org, args["<assignment_name>"],
+                                                          max_workers=int(args['--workers']))
+        for repo, outcome in outcomes.items():
+            print(f"{repo}: {outcome}")
+        report_metrics()
+        exit()
+
+    if args['--late-policy']:
+        late_policy = LatePolicy.from_file(args['--late-policy'])
+    else:
+        late_policy = DuePolicy.from_args(args)
+
+    grade_assignment(args["<assignment_name>"], org=org,
+                     github_token=os.environ['GH_TOKEN'],
+                     canvas_url=os.environ.get('CANVAS_URL', 'https://utexas.instructure.com'),
+                     canvas_token=os.environ['CANVAS_TOKEN'],
+                     course_id=os.environ['CANVAS_COURSE_ID'],
+                     google_creditials=os.environ.get('GOOGLE_CLIENT_SECRET'),
+                     multiplier=late_policy, workers=int(args['--workers']),
+                     graphql=args['--graphql'], bulk=args['--bulk'], force=args['--force'],
+                     metrics=metrics, verbose=verbose)
+
+    report_metrics()
@@ -0,0 +1,465 @@
+"""The mock_server module contains a local stand-in for the Github and Canvas APIs.
+
+It emulates the subset of endpoints used by the grader for a simulated class,
+with configurable latency, page sizes and rate limits, so that the
+concurrency and batching behaviour of the grader can be load tested without
+touching production Canvas. Point the grader at it with::
+
+    $ python -m github_canvas_grader.mock_server --students 300 --port 8000
+    $ GH_HOST=http://127.0.0.1:8000 CANVAS_URL=http://127.0.0.1:8000 python grader.py hw1
+
+Both APIs are served from the same host: Github endpoints at the root and
+Canvas endpoints below ``/api/v1``.
+"""
+
+import argparse
+import copy
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+TEMPLATES = {
+    'github_repo': {'id': 0, 'name': '', 'full_name': '', 'private': True,
+                    'default_branch': 'main'},
+    'github_workflow_run': {'id': 0, 'name': 'Autograding',
+                            'path': '.github/workflows/main.yml',
+                            'head_branch': 'main', 'status': 'completed',
+                            'conclusion': 'success',
+                            'head_commit': {'timestamp': '2023-02-03T16:41:02-06:00'}},
+    'canvas_course': {'id': 0, 'name': 'Mock Course', 'workflow_state': 'available'},
+    'canvas_assignment': {'id': 0, 'name': '', 'course_id': 0, 'points_possible': 1.0},
+    'canvas_enrollment': {'id': 0, 'course_id': 0, 'type': 'StudentEnrollment',
+                          'user_id': 0, 'user': {'id': 0, 'login_id': ''}},
+    'canvas_submission': {'id': 0, 'assignment_id': 0, 'user_id': 0, 'score': None},
+}
+
+
+class MockData:
+    """
+    State of a simulated organization and course.
+
+    Student ``i`` has the Github username ``student{i}``, the EID ``eid{i}``
+    and the Canvas user id ``1000 + i``, and owns one repo per assignment
+    named ``{assignment}-student{i}``. The latest run of every
+    `failure_every`-th student failed.
+
+    Parameters
+    ----------
+    n_students : int
+        Number of students in the class.
+    assignments : list, optional
+        Names of the assignments, by default ``['hw1']``.
+    org : str, optional
+        The organization name, by default 'mock-org'.
+    course_id : int, optional
+        The Canvas course id, by default 1.
+    failure_every : int, optional
+        Every how many students the latest run failed, by default 5.
+    templates : dict, optional
+        Payload templates overriding `TEMPLATES`, e.g. recorded responses.
+    """
+
+    def __init__(self, n_students: int, assignments: list=None, org: str='mock-org',
+                 course_id: int=1, failure_every: int=5, templates: dict=None):
+        self.org = org
+        self.course_id = course_id
+        self.assignments = {name: 100 + i for i, name in enumerate(assignments or ['hw1'])}
+        self.templates = {**TEMPLATES, **(templates or {})}
+        self.usernames = [f'student{i}' for i in range(n_students)]
+        self.eids = [f'eid{i}' for i in range(n_students)]
+        self.grades = dict()
+        self.reruns = list()
+        self.jobs = dict()
+        self.lock = threading.Lock()
+
+        self.repo_items = list()
+        self.runs = dict()
+        for name in self.assignments:
+            for i, username in enumerate(self.usernames):
+                repo = f'{name}-{username}'
+                item = copy.deepcopy(self.templates['github_repo'])
+                item.update(id=len(self.repo_items), name=repo, full_name=f'{org}/{repo}')
+                self.repo_items.append(item)
+                run = copy.deepcopy(self.templates['github_workflow_run'])
+                run.update(id=10000 + len(self.runs),
+                           conclusion='failure' if i % failure_every == 0 else 'success')
+                self.runs[repo] = run
+
+        self.enrollments = list()
+        for i, eid in enumerate(self.eids):
+            enrollment = copy.deepcopy(self.templates['canvas_enrollment'])
+            enrollment.update(id=i, user_id=1000 + i, course_id=course_id)
+            enrollment['user'].update(id=1000 + i, login_id=eid)
+            self.enrollments.append(enrollment)
+
+    @property
+    def repos(self):
+        """The names of all repos in the organization."""
+        return [item['name'] for item in self.repo_items]
+
+    def username_map_csv(self, path: str):
+        """Write the username map of the simulated class as a CSV file."""
+        with open(path, 'w') as f:
+            f.write('Github Username,EID\n')
+            for username, eid in zip(self.usernames, self.eids):
+                f.write(f'{username},{eid}\n')
+
+    def assignment_payload(self, name: str):
+        return dict(self.templates['canvas_assignment'], id=self.assignments[name],
+                    name=name, course_id=self.course_id)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Serve the subset of the Github and Canvas APIs used by the grader."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def data(self):
+        return self.server.data
+
+    def _send(self, payload, status: int=200, headers: dict=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in {**self._rate_headers, **(headers or {})}.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _page(self, items: list, query: dict):
+        per_page = min(int(query.get('per_page', [self.server.default_per_page])[0]),
+                       self.server.max_per_page)
+        page = int(query.get('page', ['1'])[0])
+        headers = dict()
+        if page * per_page < len(items):
+            host, port = self.server.server_address[:2]
+            path = urlsplit(self.path).path
+            others = ''.join(f'&{key}={value}' for key, values in query.items()
+                             for value in values if key not in ('page', 'per_page'))
+            headers['Link'] = (f'<http://{host}:{port}{path}?per_page={per_page}'
+                               f'&page={page + 1}{others}>; rel="next"')
+        return items[(page - 1) * per_page:page * per_page], headers
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode() if length else ''
+
+    def _handle(self, method: str):
+        url = urlsplit(self.path)
+        path, query = url.path, parse_qs(url.query)
+        body = self._body()
+        service = 'canvas' if path.startswith('/api/v1/') else 'github'
+
+        if self.server.latency or self.server.jitter:
+            time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+
+        allowed, self._rate_headers = self.server.take_budget(service)
+        if not allowed:
+            message = ('API rate limit exceeded' if service == 'github'
+                       else '403 Forbidden (Rate Limit Exceeded)')
+            return self._send({'message': message}, 403)
+
+        for route_method, pattern, name in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                self.server.count(name)
+                return getattr(self, name)(*match.groups(), query=query, body=body)
+
+        self.server.count('not_found')
+        self._send({'message': 'Not Found'}, 404)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    # Github endpoints
+
+    def list_org_repos(self, org, query, body):
+        items, headers = self._page(self.data.repo_items, query)
+        return self._send(items, headers=headers)
+
+    def search_repos(self, query, body):
+        term = query['q'][0].split()[0]
+        items = [item for item in self.data.repo_items if term in item['name']]
+        page, _ = self._page(items, query)
+        return self._send({'total_count': len(items), 'incomplete_results': False,
+                           'items': page})
+
+    def list_workflow_runs(self, owner, repo, workflow_id, query, body):
+        if repo not in self.data.runs:
+            return self._send({'message': 'Not Found'}, 404)
+        return self._send({'total_count': 1, 'workflow_runs': [self.data.runs[repo]]})
+
+    def list_repo_workflow_runs(self, owner, repo, query, body):
+        runs = [self.data.runs[repo]] if repo in self.data.runs else []
+        return self._send({'total_count': len(runs), 'workflow_runs': runs})
+
+    def rerun_workflow(self, owner, repo, run_id, query, body):
+        with self.data.lock:
+            self.data.reruns.append(repo)
+        return self._send({}, 201)
+
+    # Canvas endpoints
+
+    def get_course(self, course_id, query, body):
+        return self._send(dict(self.data.templates['canvas_course'],
+                               id=self.data.course_id))
+
+    def list_assignments(self, course_id, query, body):
+        items = [self.data.assignment_payload(name) for name in self.data.assignments
+                 if query.get('search_term', [''])[0] in name]
+        items, headers = self._page(items, query)
+        return self._send(items, headers=headers)
+
+    def get_assignment(self, course_id, assignment_id, query, body):
+        for name, id_ in self.data.assignments.items():
+            if str(id_) == assignment_id:
+                return self._send(self.data.assignment_payload(name))
+        return self._send({'errors': [{'message': 'The specified resource does not exist.'}]},
+                          404)
+
+    def list_enrollments(self, course_id, query, body):
+        items, headers = self._page(self.data.enrollments, query)
+        return self._send(items, headers=headers)
+
+    def get_user(self, course_id, eid, query, body):
+        if eid not in self.data.eids:
+            return self._send({'errors': [{'message': 'The specified resource does not exist.'}]},
+                              404)
+        user_id = 1000 + self.data.eids.index(eid)
+        return self._send({'id': user_id, 'login_id': eid})
+
+    def get_submission(self, course_id, assignment_id, user_id, query, body):
+        return self._send(dict(self.data.templates['canvas_submission'],
+                               assignment_id=int(assignment_id), user_id=int(user_id),
+                               score=self.data.grades.get((assignment_id, user_id))))
+
+    def edit_submission(self, course_id, assignment_id, user_id, query, body):
+        grade = parse_qs(body).get('submission[posted_grade]', [None])[0]
+        with self.data.lock:
+            self.data.grades[(assignment_id, user_id)] = grade
+        return self.get_submission(course_id, assignment_id, user_id, query, body)
+
+    def update_grades(self, course_id, assignment_id, query, body):
+        grades = dict()
+        for key, values in parse_qs(body).items():
+            match = re.fullmatch(r'grade_data\[(\d+)\]\[posted_grade\]', key)
+            if match:
+                grades[match.group(1)] = values[0]
+
+        unknown = sorted(user_id for user_id in grades
+                         if not 0 <= int(user_id) - 1000 < len(self.data.eids))
+        with self.data.lock:
+            job_id = len(self.data.jobs) + 1
+            self.data.jobs[job_id] = {'created': time.monotonic(), 'unknown': unknown}
+            if not unknown:
+                for user_id, grade in grades.items():
+                    self.data.grades[(assignment_id, user_id)] = grade
+        return self._send({'id': job_id, 'workflow_state': 'queued'})
+
+    def get_progress(self, job_id, query, body):
+        job = self.data.jobs.get(int(job_id))
+        if job is None:
+            return self._send({'errors': [{'message': 'The specified resource does not exist.'}]},
+                              404)
+        if time.monotonic() - job['created'] < self.server.job_duration:
+            return self._send({'id': int(job_id), 'workflow_state': 'running'})
+        if job['unknown']:
+            return self._send({'id': int(job_id), 'workflow_state': 'failed',
+                               'message': f"Couldn't find User(s) with API ids "
+                                          f"{', '.join(job['unknown'])}"})
+        return self._send({'id': int(job_id), 'workflow_state': 'completed'})
+
+
+ROUTES = [
+    ('GET', r'/orgs/([^/]+)/repos', 'list_org_repos'),
+    ('GET', r'/search/repositories', 'search_repos'),
+    ('GET', r'/repos/([^/]+)/([^/]+)/actions/workflows/([^/]+)/runs', 'list_workflow_runs'),
+    ('GET', r'/repos/([^/]+)/([^/]+)/actions/runs', 'list_repo_workflow_runs'),
+    ('POST', r'/repos/([^/]+)/([^/]+)/actions/runs/(\d+)/rerun', 'rerun_workflow'),
+    ('GET', r'/api/v1/courses/(\d+)', 'get_course'),
+    ('GET', r'/api/v1/courses/(\d+)/assignments', 'list_assignments'),
+    ('GET', r'/api/v1/courses/(\d+)/assignments/(\d+)', 'get_assignment'),
+    ('GET', r'/api/v1/courses/(\d+)/enrollments', 'list_enrollments'),
+    ('GET', r'/api/v1/courses/(\d+)/users/sis_login_id:([^/]+)', 'get_user'),
+    ('GET', r'/api/v1/courses/(\d+)/assignments/(\d+)/submissions/(\d+)', 'get_submission'),
+    ('PUT', r'/api/v1/courses/(\d+)/assignments/(\d+)/submissions/(\d+)', 'edit_submission'),
+    ('POST', r'/api/v1/courses/(\d+)/assignments/(\d+)/submissions/update_grades',
+     'update_grades'),
+    ('GET', r'/api/v1/progress/(\d+)', 'get_progress'),
+]
+
+
+class MockServer(ThreadingHTTPServer):
+    """
+    Serve a `MockData` class on a local port.
+
+    Use as a context manager to serve from a background thread; ``url`` is
+    the base URL of both APIs and ``calls`` counts the requests per endpoint.
+
+    Parameters
+    ----------
+    data : MockData
+        The simulated class.
+    port : int, optional
+        The port to listen on, by default a free port.
+    latency : float, optional
+        Seconds added to every response, by default 0.
+    jitter : float, optional
+        Maximum random seconds added on top of `latency`, by default 0.
+    default_per_page : int, optional
+        Page size when a request does not ask for one, by default 30.
+    max_per_page : int, optional
+        Largest page size served, by default 100.
+    github_rate_limit : int, optional
+        Github requests allowed per `github_reset_interval`, by default 5000.
+    github_reset_interval : float, optional
+        Seconds until the Github budget resets, by default 3600.
+    canvas_bucket : float, optional
+        Size of the Canvas cost bucket, by default 700.
+    canvas_cost : float, optional
+        Bucket units each Canvas request costs, by default 1.
+    canvas_refill_rate : float, optional
+        Bucket units refilled per second, by default 10.
+    job_duration : float, optional
+        Seconds a bulk update job runs before it finishes, by default 0.
+    verbose : bool, optional
+        Log every request, by default False.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data: MockData, port: int=0, latency: float=0.0, jitter: float=0.0,
+                 default_per_page: int=30, max_per_page: int=100,
+                 github_rate_limit: int=5000, github_reset_interval: float=3600.0,
+                 canvas_bucket: float=700.0, canvas_cost: float=1.0,
+                 canvas_refill_rate: float=10.0, job_duration: float=0.0,
+                 verbose: bool=False):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.data = data
+        self.latency = latency
+        self.jitter = jitter
+        self.default_per_page = default_per_page
+        self.max_per_page = max_per_page
+        self.github_rate_limit = github_rate_limit
+        self.github_reset_interval = github_reset_interval
+        self.github_remaining = github_rate_limit
+        self.github_reset = time.time() + github_reset_interval
+        self.canvas_bucket = canvas_bucket
+        self.canvas_cost = canvas_cost
+        self.canvas_refill_rate = canvas_refill_rate
+        self.canvas_remaining = canvas_bucket
+        self.canvas_updated = time.monotonic()
+        self.job_duration = job_duration
+        self.verbose = verbose
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def take_budget(self, service: str):
+        """
+        Charge a request against a service's rate limit.
+
+        Returns
+        -------
+        tuple
+            Whether the request is allowed, and the rate limit headers to send.
+        """
+        with self._lock:
+            if service == 'github':
+                if time.time() >= self.github_reset:
+                    self.github_remaining = self.github_rate_limit
+                    self.github_reset = time.time() + self.github_reset_interval
+                allowed = self.github_remaining > 0
+                self.github_remaining = max(self.github_remaining - 1, 0)
+                return allowed, {
+                    'X-RateLimit-Limit': str(self.github_rate_limit),
+                    'X-RateLimit-Remaining': str(self.github_remaining),
+                    'X-RateLimit-Used': str(self.github_rate_limit - self.github_remaining),
+                    'X-RateLimit-Reset': str(math.ceil(self.github_reset))}
+
+            now = time.monotonic()
+            self.canvas_remaining = min(self.canvas_bucket, self.canvas_remaining +
+                                        (now - self.canvas_updated) * self.canvas_refill_rate)
+            self.canvas_updated = now
+            allowed = self.canvas_remaining >= self.canvas_cost
+            if allowed:
+                self.canvas_remaining -= self.canvas_cost
+            return allowed, {'X-Rate-Limit-Remaining': f'{self.canvas_remaining:.1f}',
+                             'X-Request-Cost': f'{self.canvas_cost:.1f}'}
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    """Run a mock server from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=100)
+    parser.add_argument('--assignment', action='append', dest='assignments')
+    parser.add_argument('--org', default='mock-org')
+    parser.add_argument('--course-id', type=int, default=1)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--per-page', type=int, default=30)
+    parser.add_argument('--max-per-page', type=int, default=100)
+    parser.add_argument('--github-rate-limit', type=int, default=5000)
+    parser.add_argument('--canvas-bucket', type=float, default=700.0)
+    parser.add_argument('--canvas-refill-rate', type=float, default=10.0)
+    parser.add_argument('--job-duration', type=float, default=0.0)
+    parser.add_argument('--username-map', help='write the username map CSV to this path')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    data = MockData(args.students, args.assignments, org=args.org, course_id=args.course_id)
+    if args.username_map:
+        data.username_map_csv(args.username_map)
+
+    server = MockServer(data, port=args.port, latency=args.latency, jitter=args.jitter,
+                        default_per_page=args.per_page, max_per_page=args.max_per_page,
+                        github_rate_limit=args.github_rate_limit,
+                        canvas_bucket=args.canvas_bucket,
+                        canvas_refill_rate=args.canvas_refill_rate,
+                        job_duration=args.job_duration, verbose=args.verbose)
+    print(f"Serving {args.students} students of {args.org} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('Requests served:')
+        for endpoint, calls in sorted(server.calls.items()):
+            print(f'    {endpoint}: {calls}')
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
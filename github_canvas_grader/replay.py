@@ -0,0 +1,177 @@
+"""The replay module contains a Github API stand-in that replays a recorded fixture.
+
+A fixture is a JSON file describing an organization's repos, the latest
+workflow run of each repo and the latency of each endpoint::
+
+    {
+      "org": "my-class-org",
+      "repos": ["hw1-alice", "hw1-bob"],
+      "runs": {"hw1-alice": {"id": 1, "conclusion": "success",
+                             "head_commit": {"timestamp": "2023-01-01T12:00:00Z"}}},
+      "latency": {"default": 0.05, "re_run_workflow": 0.2}
+    }
+
+`ReplayGhApi` serves the subset of the ``GhApi`` interface used by the
+grader from such a fixture, counting calls and sleeping for the recorded
+latency, so that API call counts and wall time can be measured offline.
+"""
+
+import json
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from urllib.error import HTTPError
+
+
+class ReplayGhApi:
+    """
+    Replay a recorded fixture through the subset of ``GhApi`` used by the grader.
+
+    Parameters
+    ----------
+    fixture : dict
+        The recorded fixture, see the module documentation.
+    latency_scale : float, optional
+        Factor applied to every recorded latency, by default 1.0. Use 0 to
+        replay without sleeping.
+    """
+
+    def __init__(self, fixture: dict, latency_scale: float=1.0):
+        self.org = fixture.get('org', 'org')
+        self.repo_names = list(fixture.get('repos', []))
+        self.runs = dict(fixture.get('runs', {}))
+        self.latency = dict(fixture.get('latency', {}))
+        self.latency_scale = latency_scale
+        self.calls = Counter()
+        self.reruns = list()
+        self.recv_hdrs = dict()
+        self._lock = threading.Lock()
+
+        self.repos = SimpleNamespace(list_for_org=self._list_for_org)
+        self.search = SimpleNamespace(repos=self._search_repos)
+        self.actions = SimpleNamespace(list_workflow_runs=self._list_workflow_runs,
+                                       re_run_workflow=self._re_run_workflow)
+
+    @classmethod
+    def from_file(cls, path: str, latency_scale: float=1.0):
+        """
+        Load a fixture from a JSON file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the fixture file.
+        latency_scale : float, optional
+            Factor applied to every recorded latency, by default 1.0.
+
+        Returns
+        -------
+        ReplayGhApi
+            The replaying API object.
+        """
+        with open(path) as f:
+            return cls(json.load(f), latency_scale)
+
+    @property
+    def total_calls(self):
+        """The total number of API calls made."""
+        return sum(self.calls.values())
+
+    def _call(self, endpoint: str):
+        with self._lock:
+            self.calls[endpoint] += 1
+            self.recv_hdrs = {'X-RateLimit-Remaining': str(max(5000 - self.total_calls, 0)),
+                              'X-RateLimit-Reset': str(int(time.time()) + 3600)}
+        delay = self.latency.get(endpoint, self.latency.get('default', 0.0))
+        if delay * self.latency_scale > 0:
+            time.sleep(delay * self.latency_scale)
+
+    def _list_for_org(self, org: str, per_page: int=30, page: int=1):
+        self._call('list_for_org')
+        return [{'name': name}
+                for name in self.repo_names[(page - 1) * per_page:page * per_page]]
+
+    def _search_repos(self, q: str, per_page: int=30, page: int=1):
+        self._call('search_repos')
+        term = q.split()[0]
+        items = [{'name': name} for name in self.repo_names if term in name]
+        return {'total_count': len(items), 'incomplete_results': False,
+                'items': items[(page - 1) * per_page:page * per_page]}
+
+    def _list_workflow_runs(self, repo: str, workflow_id: str, per_page: int=30, **filters):
+        self._call('list_workflow_runs')
+        if repo not in self.repo_names:
+            raise HTTPError(repo, 404, 'Not Found', {}, None)
+        run = self.runs.get(repo)
+        return {'total_count': int(run is not None),
+                'workflow_runs': [run] if run is not None else []}
+
+    def _re_run_workflow(self, repo: str, run_id: int):
+        self._call('re_run_workflow')
+        with self._lock:
+            self.reruns.append(repo)
+
+
+def record_fixture(api, org: str, assignment_name: str, path: str,
+                   workflow_filename: str='main.yml'):
+    """
+    Record a fixture of an assignment's repos and latest workflow runs.
+
+    Latencies are recorded per request: the organization listing is timed
+    page by page, as `ReplayGhApi` sleeps once for every page it serves.
+
+    Parameters
+    ----------
+    api : GhApi
+        The Github API object.
+    org : str
+        The organization name.
+    assignment_name : str
+        The assignment name used to filter the repos.
+    path : str
+        Path of the fixture file to write.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+
+    Returns
+    -------
+    dict
+        The recorded fixture.
+    """
+    from .github_canvas_grader import get_latest_workflow_run
+
+    per_page = 100
+    repos = list()
+    page_latencies = list()
+    while True:
+        start = time.perf_counter()
+        items = api.repos.list_for_org(org=org, per_page=per_page,
+                                       page=len(page_latencies) + 1)
+        page_latencies.append(time.perf_counter() - start)
+        repos.extend(item['name'] for item in items
+                     if assignment_name in item['name'])
+        if len(items) < per_page:
+            break
+    page_latency = sum(page_latencies) / len(page_latencies)
+
+    runs = dict()
+    latencies = list()
+    for repo in repos:
+        start = time.perf_counter()
+        run = get_latest_workflow_run(api, repo, workflow_filename)
+        latencies.append(time.perf_counter() - start)
+        if run is not None:
+            runs[repo] = {'id': run['id'], 'conclusion': run['conclusion'],
+                          'head_commit': {'timestamp': run['head_commit']['timestamp']}}
+
+    default = sum(latencies) / len(latencies) if latencies else 0.0
+    fixture = {'org': org, 'repos': repos, 'runs': runs,
+               'latency': {'default': default,
+                           'search_repos': page_latency,
+                           'list_for_org': page_latency}}
+
+    with open(path, 'w') as f:
+        json.dump(fixture, f, indent=2)
+
+    return fixture
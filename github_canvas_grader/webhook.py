@@ -0,0 +1,420 @@
+"""The webhook module grades single repositories from Github ``workflow_run`` webhooks.
+
+Instead of polling every repository of an assignment, the grader can run as
+a long-lived server receiving the ``workflow_run`` events of an organization
+webhook. Every completed run of the grading workflow is graded as soon as
+it is delivered, from the run in the event itself, while the username map,
+assignment index and course roster stay warm in memory::
+
+    $ GRADER_WEBHOOK_SECRET=... github_canvas_grader serve --port 8080
+
+Deliveries are authenticated with the ``X-Hub-Signature-256`` HMAC of the
+webhook secret. `send_webhook` signs and posts an event like Github does,
+so that a server can be exercised locally, e.g. against the mock server::
+
+    $ GRADER_WEBHOOK_SECRET=... github_canvas_grader replay http://127.0.0.1:8080 --repo hw1-alice
+"""
+
+import fnmatch
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from . import github_canvas_grader as grader
+
+# Github does not deliver payloads larger than 25 MB
+MAX_PAYLOAD_BYTES = 25 * 1024 * 1024
+
+
+def sign(secret: str, body: bytes):
+    """
+    Compute the ``X-Hub-Signature-256`` header of a webhook delivery.
+
+    Parameters
+    ----------
+    secret : str
+        The webhook secret.
+    body : bytes
+        The body of the delivery.
+
+    Returns
+    -------
+    str
+        The hex HMAC-SHA256 digest of the body prefixed with ``sha256=``.
+    """
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+def verify_signature(secret: str, body: bytes, signature: str):
+    """
+    Check the ``X-Hub-Signature-256`` header of a webhook delivery.
+
+    Parameters
+    ----------
+    secret : str
+        The webhook secret.
+    body : bytes
+        The body of the delivery.
+    signature : str
+        The value of the signature header, or None if it is missing.
+
+    Returns
+    -------
+    bool
+        Whether the signature matches the body.
+    """
+    if not signature:
+        return False
+    return hmac.compare_digest(sign(secret, body), signature)
+
+def workflow_run_payload(org: str, repo: str, run: dict):
+    """
+    Build the payload of a completed ``workflow_run`` event.
+
+    Parameters
+    ----------
+    org : str
+        The Github organization name.
+    repo : str
+        The repository name.
+    run : dict
+        The workflow run, as returned by `grader.get_latest_workflow_run`.
+
+    Returns
+    -------
+    dict
+        The subset of Github's event payload used by `WebhookGrader`.
+    """
+    return {'action': 'completed', 'workflow_run': run,
+            'repository': {'name': repo, 'full_name': f'{org}/{repo}',
+                           'owner': {'login': org}},
+            'organization': {'login': org}}
+
+def send_webhook(url: str, payload: dict, secret: str, event: str='workflow_run',
+                 timeout: float=30.0):
+    """
+    Sign and post a webhook delivery like Github does.
+
+    Parameters
+    ----------
+    url : str
+        The URL of the webhook server.
+    payload : dict
+        The event payload.
+    secret : str
+        The webhook secret used to sign the delivery.
+    event : str, optional
+        The ``X-GitHub-Event`` header, by default 'workflow_run'.
+    timeout : float, optional
+        Seconds to wait for the response, by default 30.
+
+    Returns
+    -------
+    tuple
+        The HTTP status code and the decoded JSON response.
+    """
+    body = json.dumps(payload).encode()
+    request = Request(url, data=body, method='POST',
+                      headers={'Content-Type': 'application/json',
+                               'X-GitHub-Event': event,
+                               'X-GitHub-Delivery': f'replay-{time.time_ns()}',
+                               'X-Hub-Signature-256': sign(secret, body)})
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'{}')
+    except HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+
+
+class WebhookGrader:
+    """
+    Grade the repository of each completed workflow run of an organization.
+
+    The Canvas course, username map, assignment index and roster are read
+    once and reused by every event. Unknown Github usernames reload the
+    username map and unknown repository prefixes refresh the assignment
+    index, at most once every `reload_interval` seconds. The grade state
+    is kept in ``GRADER_CACHE_DIR`` if it is set, see `grader.cache_path`,
+    so that deliveries of runs older than the graded one are skipped.
+
+    Parameters
+    ----------
+    org : str
+        The Github organization name.
+    canvas_token : str
+        The Canvas token.
+    course_id : int or str
+        The Canvas course id.
+    canvas_url : str, optional
+        The base URL of the Canvas instance, by default 'https://utexas.instructure.com'.
+    assignments : list, optional
+        Assignment names or glob patterns to grade, by default all assignments.
+    username_map : UsernameMap, optional
+        The username map, by default read with `grader.read_username_map`.
+    google_creditials : str, optional
+        Encoded Google credentials used to read the username map from a Google sheet.
+    workflow_filename : str, optional
+        The workflow filename (default is 'main.yml').
+    multiplier : callable, optional
+        Function mapping a Series of commit times to score multipliers, e.g.
+        a `DuePolicy` or `LatePolicy`. By default always 1.0.
+    force : bool, optional
+        Upload grades even if they are unchanged, by default False.
+    reload_interval : float, optional
+        Minimum seconds between reloads of the username map or assignment
+        index, by default 60.
+    metrics : Metrics, optional
+        Metrics recording the time spent in each phase and API endpoint.
+    verbose : bool, optional
+        Print every updated grade, by default True.
+    """
+
+    def __init__(self, org: str, canvas_token: str, course_id,
+                 canvas_url: str='https://utexas.instructure.com', assignments: list=None,
+                 username_map=None, google_creditials: str=None,
+                 workflow_filename: str='main.yml', multiplier=None, force: bool=False,
+                 reload_interval: float=60.0, metrics: grader.Metrics=None,
+                 verbose: bool=True):
+        from canvasapi import Canvas
+
+        self.org = org
+        self.patterns = list(assignments or [])
+        self.google_creditials = google_creditials
+        self.workflow_filename = workflow_filename
+        self.multiplier = multiplier
+        self.force = force
+        self.reload_interval = reload_interval
+        self.metrics = metrics if metrics is not None else grader.Metrics()
+        self.verbose = verbose
+        self.lock = threading.Lock()
+
+        self.course = Canvas(canvas_url, canvas_token).get_course(course_id)
+        self.scheduler = grader.RequestScheduler()
+        self.scheduler.install_canvas_hook(self.course)
+        self.metrics.install_canvas_hook(self.course)
+
+        with self.metrics.phase('read_username_map'):
+            self.username_map = (grader.as_username_map(username_map)
+                                 if username_map is not None else self._read_username_map())
+        with self.metrics.phase('canvas_lookups'):
+            self.assignments = grader.AssignmentResolver(self.course,
+                                                         grader.cache_path('assignments.json'))
+            if not self.assignments.index:
+                self.assignments.refresh()
+            self.roster = grader.RosterCache(self.course, grader.cache_path('roster.json'))
+        self.reloaded_at = {'username_map': time.monotonic(), 'assignments': time.monotonic()}
+
+    def _read_username_map(self):
+        username_map = grader.read_username_map(self.google_creditials, self.org)
+        if username_map is None:
+            raise ValueError('The username map could not be read')
+        return username_map
+
+    def _may_reload(self, cache: str):
+        now = time.monotonic()
+        if now - self.reloaded_at[cache] < self.reload_interval:
+            return False
+        self.reloaded_at[cache] = now
+        return True
+
+    def assignment_for(self, repo: str):
+        """
+        Find the assignment of a repository from its name.
+
+        Parameters
+        ----------
+        repo : str
+            The repository name.
+
+        Returns
+        -------
+        str
+            The name of the assignment whose name followed by a dash is the
+            longest prefix of the repository name.
+        None
+            If no assignment matches.
+        """
+        for attempt in range(2):
+            names = [name for name in self.assignments.index
+                     if not self.patterns or any(fnmatch.fnmatchcase(name, pattern)
+                                                 for pattern in self.patterns)]
+            partitions = grader.partition_repos([repo], names)
+            for name, repos in partitions.items():
+                if repos:
+                    return name
+            if attempt == 0 and self._may_reload('assignments'):
+                self.assignments.refresh()
+        return None
+
+    def handle(self, event: str, payload: dict):
+        """
+        Grade the repository of a ``workflow_run`` event.
+
+        Events are handled one at a time. Other events, runs that are not
+        completed, runs of other workflows or organizations and repositories
+        of no known assignment are ignored.
+
+        Parameters
+        ----------
+        event : str
+            The ``X-GitHub-Event`` header of the delivery.
+        payload : dict
+            The event payload.
+
+        Returns
+        -------
+        dict
+            ``status`` is 'pong', 'ignored', 'outdated' or 'graded' and
+            ``reason`` explains ignored events. Graded events also have the
+            ``repo``, ``assignment``, ``grades`` and ``failures`` of
+            `grader.grade_runs`.
+        """
+        if event == 'ping':
+            return {'status': 'pong'}
+        if event != 'workflow_run':
+            return {'status': 'ignored', 'reason': f'{event} events are not graded'}
+
+        run = payload.get('workflow_run') or {}
+        repository = payload.get('repository') or {}
+        repo = repository.get('name')
+        if payload.get('action') != 'completed':
+            return {'status': 'ignored', 'reason': f"the run is {payload.get('action')}"}
+        if not run.get('path', '').endswith(f'/{self.workflow_filename}'):
+            return {'status': 'ignored', 'reason': f"{run.get('path')} is not graded"}
+        if (repository.get('owner') or {}).get('login') != self.org:
+            return {'status': 'ignored',
+                    'reason': f"{repository.get('full_name')} is not in {self.org}"}
+
+        with self.lock:
+            return self._grade(repo, run)
+
+    def _grade(self, repo: str, run: dict):
+        with self.metrics.phase('canvas_lookups'):
+            assignment_name = self.assignment_for(repo)
+            assignment = (self.assignments.get_assignment(assignment_name)
+                          if assignment_name is not None else None)
+        if assignment is None:
+            return {'status': 'ignored', 'reason': f'{repo} is not the repo of an assignment'}
+
+        github_username = grader.strip_github_username(repo).lower()
+        if github_username not in self.username_map and self._may_reload('username_map'):
+            with self.metrics.phase('read_username_map'):
+                self.username_map = self._read_username_map()
+
+        state_file = grader.cache_path('state.sqlite')
+        state = grader.GradeStateStore(state_file) if state_file else None
+        try:
+            recorded = state.get(assignment_name, repo) if state is not None else None
+            if (recorded is not None and recorded['run_id'] is not None and
+                recorded['run_id'] > run['id']):
+                return {'status': 'outdated', 'repo': repo, 'assignment': assignment_name,
+                        'reason': f"run {recorded['run_id']} was already graded"}
+
+            with self.metrics.phase('grade_and_upload'):
+                result = grader.grade_runs({repo: run}, assignment_name, self.username_map,
+                                           self.roster, assignment,
+                                           multiplier=self.multiplier,
+                                           scheduler=self.scheduler, state=state,
+                                           force=self.force, verbose=self.verbose)
+        finally:
+            if state is not None:
+                state.close()
+
+        return {'status': 'graded', 'repo': repo, 'assignment': assignment_name,
+                'grades': {str(canvas_id): score
+                           for canvas_id, score in result['grades'].items()},
+                'failures': {str(canvas_id): message
+                             for canvas_id, message in result['failures'].items()}}
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    Verify webhook deliveries and pass them to the server's `WebhookGrader`.
+
+    Bodies larger than `MAX_PAYLOAD_BYTES` are rejected without being read.
+    """
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, payload: dict, status: int=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        # Checked before reading, since the body is not authenticated yet
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._send({'message': 'Invalid Content-Length'}, 400)
+        if length > MAX_PAYLOAD_BYTES:
+            return self._send({'message': 'Payload too large'}, 413)
+
+        body = self.rfile.read(length)
+        if not verify_signature(self.server.secret, body,
+                                self.headers.get('X-Hub-Signature-256')):
+            return self._send({'message': 'Invalid signature'}, 401)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._send({'message': 'Invalid JSON payload'}, 400)
+
+        try:
+            result = self.server.grader.handle(self.headers.get('X-GitHub-Event', ''), payload)
+        except Exception as e:
+            print(f"Failed to handle delivery {self.headers.get('X-GitHub-Delivery')}: {e!r}")
+            return self._send({'message': repr(e)}, 500)
+        if result.get('repo'):
+            print(f"{result['repo']}: {result['status']}")
+        return self._send(result)
+
+
+class WebhookServer(HTTPServer):
+    """
+    Serve a `WebhookGrader` on a local port.
+
+    Deliveries are handled one at a time. Use as a context manager to serve
+    from a background thread; ``url`` is the URL to deliver events to.
+
+    Parameters
+    ----------
+    webhook_grader : WebhookGrader
+        The grader handling the events.
+    secret : str
+        The webhook secret deliveries are signed with.
+    host : str, optional
+        The address to listen on, by default '127.0.0.1'.
+    port : int, optional
+        The port to listen on, by default a free port.
+    verbose : bool, optional
+        Log every request, by default False.
+    """
+
+    def __init__(self, webhook_grader: WebhookGrader, secret: str, host: str='127.0.0.1',
+                 port: int=0, verbose: bool=False):
+        if not secret:
+            raise ValueError('A webhook secret is required')
+        super().__init__((host, port), WebhookHandler)
+        self.grader = webhook_grader
+        self.secret = secret
+        self.verbose = verbose
+        self.url = f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -45,6 +45,9 @@ setup(
         ],
     },
     install_requires=install_requires,
+    extras_require={
+        'async': ['httpx>=0.24'],
+    },
     dependency_links=dependency_links,
     license="Apache Software License 2.0",
     long_description=readme,
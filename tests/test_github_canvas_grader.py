@@ -3,11 +3,183 @@
 """Tests for `github_canvas_grader` package."""
 
 
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+from types import SimpleNamespace
+from unittest import mock
+from urllib.error import HTTPError
 
 from github_canvas_grader import github_canvas_grader
 
 
+class FakeProgress:
+    """A Canvas Progress stand-in that finishes after one poll."""
+
+    def __init__(self, succeed, message=None):
+        self.id = 1
+        self.workflow_state = 'queued'
+        self.succeed = succeed
+        self.message = message
+
+    def query(self):
+        self.workflow_state = 'completed' if self.succeed else 'failed'
+        return self
+
+
+class FakeAssignment:
+    """An Assignment stand-in whose bulk update fails for bad user ids."""
+
+    def __init__(self, bad_ids=(), error=None):
+        self.bad_ids = set(bad_ids)
+        self.error = error
+        self.calls = list()
+        self.posted = dict()
+
+    def submissions_bulk_update(self, grade_data):
+        self.calls.append(dict(grade_data))
+        if self.error is not None:
+            raise self.error
+        bad = self.bad_ids.intersection(grade_data)
+        if not bad:
+            self.posted.update(grade_data)
+        return FakeProgress(not bad, f"Couldn't find User(s) {sorted(bad)}")
+
+
+class FakeCourse:
+    """A Course stand-in that counts assignment listings."""
+
+    def __init__(self, names):
+        self.id = 42
+        self.listings = 0
+        self.names = names
+
+    def get_assignments(self):
+        self.listings += 1
+        return [SimpleNamespace(name=name, id=i)
+                for i, name in enumerate(self.names)]
+
+    def get_assignment(self, assignment_id):
+        return SimpleNamespace(name=self.names[assignment_id], id=assignment_id)
+
+    def get_enrollments(self, type):
+        self.listings += 1
+        return [SimpleNamespace(user_id=100 + i, user={'login_id': eid})
+                for i, eid in enumerate(['ABC123', 'def456'])]
+
+    def get_user(self, user, id_type):
+        self.user_lookups = getattr(self, 'user_lookups', 0) + 1
+        return SimpleNamespace(id=999)
+
+
+class FakeActions:
+    """A GitHub Actions API stand-in serving one run per repo."""
+
+    def __init__(self, runs):
+        self.runs = runs
+
+    def list_workflow_runs(self, repo, workflow_id, per_page, **filters):
+        if repo not in self.runs:
+            raise HTTPError(repo, 404, 'Not Found', {}, None)
+        return {'total_count': 1, 'workflow_runs': [self.runs[repo]]}
+
+    def re_run_workflow(self, repo, run_id):
+        if self.runs[repo]['conclusion'] is None:
+            raise HTTPError(repo, 403, 'This workflow is already running', {}, None)
+        self.reruns = getattr(self, 'reruns', []) + [run_id]
+
+
+class FakeRepos:
+    """A GitHub repos API stand-in serving an org listing."""
+
+    def __init__(self, names):
+        self.names = names
+        self.calls = 0
+
+    def list_for_org(self, org, per_page, page):
+        self.calls += 1
+        return [{'name': name}
+                for name in self.names[(page - 1) * per_page:page * per_page]]
+
+
+class FakeSearch:
+    """A GitHub search API stand-in using token matching on names."""
+
+    def __init__(self, names, incomplete=False):
+        self.names = names
+        self.incomplete = incomplete
+
+    def repos(self, q, per_page, page):
+        term = q.split()[0]
+        items = [{'name': name} for name in self.names
+                 if term in name.split('-')]
+        return {'total_count': len(items),
+                'incomplete_results': self.incomplete,
+                'items': items[(page - 1) * per_page:page * per_page]}
+
+
+class FakeConditionalApi:
+    """A callable GhApi stand-in answering repeated page requests with 304."""
+
+    def __init__(self, names):
+        self.names = names
+        self.recv_hdrs = dict()
+        self.statuses = list()
+
+    def __call__(self, path, verb, headers=None, route=None, query=None):
+        assert (query['sort'], query['direction']) == ('created', 'asc')
+        page, per_page = query['page'], query['per_page']
+        names = self.names[(page - 1) * per_page:page * per_page]
+        etag = f'"{page}-{len(names)}"'
+        if (headers or {}).get('If-None-Match') == etag:
+            self.statuses.append(304)
+            raise HTTPError(path, 304, 'Not Modified', {}, None)
+        self.statuses.append(200)
+        self.recv_hdrs = {'etag': etag}
+        return [{'name': name} for name in names]
+
+
+def fake_run(run_id, conclusion, timestamp='2023-01-01T12:00:00Z'):
+    """Build a minimal workflow run payload."""
+    return {'id': run_id, 'name': 'main.yml', 'conclusion': conclusion,
+            'head_commit': {'timestamp': timestamp}}
+
+
+@contextlib.contextmanager
+def mock_class(data, environ=None, **options):
+    """
+    Serve a mock class and run the grader against it from a temporary directory.
+
+    The grader's environment variables point at a `MockServer` started with
+    `options`, the working directory holds the class's username map and
+    stdout is captured. Yields the ``server``, the ``tmp`` directory and the
+    captured ``output``.
+    """
+    from github_canvas_grader.mock_server import MockServer
+
+    cwd = os.getcwd()
+    output = io.StringIO()
+    with tempfile.TemporaryDirectory() as tmp, MockServer(data, **options) as server, \
+         mock.patch.dict(os.environ, {'GITHUB_REPOSITORY': f'{data.org}/grader',
+                                      'GH_TOKEN': 'mock', 'GH_HOST': server.url,
+                                      'CANVAS_TOKEN': 'mock', 'CANVAS_URL': server.url,
+                                      'CANVAS_COURSE_ID': str(data.course_id),
+                                      **(environ or {})}):
+        data.username_map_csv(os.path.join(tmp, 'username_map.csv'))
+        os.chdir(tmp)
+        try:
+            with contextlib.redirect_stdout(output):
+                yield SimpleNamespace(server=server, tmp=tmp, output=output)
+        finally:
+            os.chdir(cwd)
+
+
 class TestGithub_canvas_grader(unittest.TestCase):
     """Tests for `github_canvas_grader` package."""
 
@@ -19,3 +191,692 @@ class TestGithub_canvas_grader(unittest.TestCase):
 
     def test_000_something(self):
         """Test something."""
+
+    def test_001_upload_grades_in_bulk(self):
+        """Test batched grade upload and isolation of failing students."""
+        assignment = FakeAssignment(bad_ids={3})
+        grades = {i: 1.0 for i in range(1, 9)}
+
+        failures = github_canvas_grader.upload_grades_in_bulk(
+            assignment, grades, batch_size=4, poll_interval=0)
+
+        self.assertEqual(list(failures), [3])
+        self.assertEqual(set(assignment.posted), set(grades) - {3})
+        self.assertEqual(len(assignment.calls[0]), 4)
+
+        # A failed request is not bisected, and token errors are raised
+        from canvasapi.exceptions import CanvasException, InvalidAccessToken
+        assignment = FakeAssignment(error=CanvasException('Internal Server Error'))
+        failures = github_canvas_grader.upload_grades_in_bulk(
+            assignment, grades, batch_size=4, poll_interval=0)
+        self.assertEqual(set(failures), set(grades))
+        self.assertEqual(len(assignment.calls), 2)
+
+        assignment = FakeAssignment(error=InvalidAccessToken('Invalid access token'))
+        with self.assertRaises(InvalidAccessToken):
+            github_canvas_grader.upload_grades_in_bulk(
+                assignment, grades, batch_size=4, poll_interval=0)
+
+    def test_002_assignment_resolver(self):
+        """Test that assignments are listed once and the index persists."""
+        course = FakeCourse(['hw1', 'hw2'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index_file = os.path.join(tmp, 'assignments.json')
+            resolver = github_canvas_grader.AssignmentResolver(course, index_file)
+            for _ in range(3):
+                assignment = resolver.get_assignment('hw2')
+            self.assertEqual(assignment.id, 1)
+            self.assertEqual(course.listings, 1)
+
+            resolver = github_canvas_grader.AssignmentResolver(course, index_file)
+            self.assertEqual(resolver.get_assignment_id('hw1'), 0)
+            self.assertEqual(course.listings, 1)
+
+    def test_003_fetch_workflow_results_concurrently(self):
+        """Test that concurrent fetching preserves repo order and results."""
+        runs = {f'hw1-user{i}': fake_run(i, 'success') for i in range(20)}
+        api = SimpleNamespace(actions=FakeActions(runs))
+        repos = list(runs) + ['hw1-missing']
+
+        results = github_canvas_grader.fetch_workflow_commit_times_and_conclusions(
+            api, repos, max_workers=4)
+
+        self.assertEqual(list(results), repos)
+        self.assertEqual(results['hw1-user3'], ('2023-01-01T12:00:00Z', 'success'))
+        self.assertEqual(results['hw1-missing'], (None, None))
+
+    def test_004_roster_cache(self):
+        """Test that EIDs resolve from one enrollment sweep and a TTL cache."""
+        course = FakeCourse([])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, 'roster.json')
+            roster = github_canvas_grader.RosterCache(course, cache_file)
+            self.assertEqual(roster.canvas_id_for('abc123'), 100)
+            self.assertEqual(roster.canvas_id_for('DEF456'), 101)
+            self.assertEqual(roster.canvas_id_for('late999'), 999)
+            self.assertEqual(course.listings, 1)
+            self.assertEqual(course.user_lookups, 1)
+
+            roster = github_canvas_grader.RosterCache(course, cache_file)
+            self.assertEqual(roster.canvas_id_for('late999'), 999)
+            self.assertEqual(course.listings, 1)
+
+            github_canvas_grader.RosterCache(course, cache_file, ttl=0)
+            self.assertEqual(course.listings, 2)
+
+    def test_005_discover_repos(self):
+        """Test listing and search based discovery and its fallback to the listing."""
+        names = ([f'hw1-user{i}' for i in range(150)] +
+                 [f'hw2-user{i}' for i in range(150)])
+        repos = FakeRepos(names)
+        api = SimpleNamespace(repos=repos, search=FakeSearch(names))
+
+        found = github_canvas_grader.discover_repos(api, 'org', 'hw1', backend='search')
+        self.assertEqual(len(found), 150)
+        self.assertEqual(repos.calls, 0)
+
+        api.search = FakeSearch(names, incomplete=True)
+        found = github_canvas_grader.discover_repos(api, 'org', 'hw2', backend='search')
+        self.assertEqual(len(found), 150)
+        self.assertEqual(repos.calls, 4)
+
+        # The search index may lag behind new repos, so it is only used on request
+        api.search = FakeSearch(names[:10])
+        found = github_canvas_grader.discover_repos(api, 'org', 'hw1')
+        self.assertEqual(len(found), 150)
+        self.assertEqual(repos.calls, 8)
+
+    def test_006_repo_listing_etag_cache(self):
+        """Test that unchanged listing pages are served from the ETag cache."""
+        api = FakeConditionalApi([f'hw1-user{i}' for i in range(150)])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_file = os.path.join(tmp, 'repos.json')
+            first = github_canvas_grader.filter_repos(api, 'org', 'hw1', cache_file)
+            second = github_canvas_grader.filter_repos(api, 'org', 'hw1', cache_file)
+            # A new repository is listed last and only changes the last page
+            api.names.append('hw1-new')
+            third = github_canvas_grader.filter_repos(api, 'org', 'hw1', cache_file)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(second), 150)
+        self.assertEqual(third, second + ['hw1-new'])
+        self.assertEqual(api.statuses, [200, 200, 304, 304, 304, 200])
+
+    def test_008_graphql_commit_time_and_conclusion(self):
+        """Test extraction of workflow results from GraphQL repository data."""
+        def repository(suites, rollup=None):
+            return {'defaultBranchRef': {'target': {
+                'committedDate': '2023-01-01T12:00:00Z',
+                'statusCheckRollup': {'state': rollup} if rollup else None,
+                'checkSuites': {'nodes': [
+                    {'conclusion': conclusion,
+                     'workflowRun': {'file': {'path': f'.github/workflows/{name}'}}}
+                    for name, conclusion in suites]}}}}
+
+        extract = github_canvas_grader.graphql_commit_time_and_conclusion
+        self.assertEqual(
+            extract(repository([('main.yml', 'FAILURE'), ('lint.yml', 'FAILURE'),
+                                ('main.yml', 'SUCCESS')])),
+            ('2023-01-01T12:00:00Z', 'success'))
+        self.assertEqual(extract(repository([], rollup='ERROR')),
+                         ('2023-01-01T12:00:00Z', 'failure'))
+        self.assertEqual(extract(repository([], rollup='PENDING')), (None, None))
+        self.assertEqual(extract(None), (None, None))
+
+    def test_009_request_scheduler_retries_throttled_calls(self):
+        """Test that throttled calls are retried and concurrency backs off."""
+        scheduler = github_canvas_grader.RequestScheduler(max_concurrency=8)
+        attempts = list()
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise HTTPError('url', 403, 'secondary rate limit',
+                                {'Retry-After': '0'}, None)
+            return 'ok'
+
+        api = SimpleNamespace(recv_hdrs={'X-RateLimit-Remaining': '4999',
+                                         'X-RateLimit-Reset': '0'})
+        self.assertEqual(scheduler.github(api, flaky), 'ok')
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(scheduler.throttled, 2)
+        self.assertEqual(scheduler.concurrency, 2)
+        self.assertEqual(scheduler.github_remaining, 4999)
+
+        def not_found():
+            raise HTTPError('url', 404, 'Not Found', {}, None)
+
+        with self.assertRaises(HTTPError):
+            scheduler.github(api, not_found)
+
+    def test_010_grade_state_store(self):
+        """Test that unchanged runs and scores are detected across runs."""
+        graded = ('hw1', 'hw1-user', 7, '2023-01-01T12:00:00Z', 'success', 1.0)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'state.sqlite')
+            state = github_canvas_grader.GradeStateStore(path)
+            self.assertFalse(state.is_unchanged(*graded))
+            state.record(*graded)
+            state.close()
+
+            state = github_canvas_grader.GradeStateStore(path)
+            self.assertTrue(state.is_unchanged(*graded))
+            self.assertFalse(state.is_unchanged(*graded[:2], 8, *graded[3:]))
+            self.assertFalse(state.is_unchanged(*graded[:5], 1.1))
+            state.close()
+
+    def test_010_force_usage(self):
+        """Test that --force is accepted with every grading option."""
+        from docopt import docopt
+
+        due = ['--due', '2023-02-03', '23:59:59', 'CST', '1.1']
+        for argv in (['hw1', '--force', '--env', 'A', 'B'], ['hw1', '--force', *due],
+                     ['hw1', '--force', *due, '--env', 'A', 'B']):
+            self.assertTrue(docopt(github_canvas_grader.__doc__, argv)['--force'])
+
+    @unittest.skipUnless(importlib.util.find_spec('httpx'),
+                         'httpx is only installed with the async extra')
+    def test_011_async_grade_assignment(self):
+        """Test the asyncio pipeline end to end against a mock transport."""
+        import asyncio
+
+        import httpx
+        import pandas as pd
+
+        from github_canvas_grader import aio
+
+        posted = dict()
+
+        def handler(request):
+            path = request.url.path
+            if path == '/orgs/org/repos':
+                return httpx.Response(200, json=[{'name': 'hw1-alice'}, {'name': 'hw1-bob'},
+                                                 {'name': 'hw1-carol'}, {'name': 'hw2-alice'},
+                                                 {'name': 'hw10-alice'}])
+            if path.endswith('/actions/workflows/main.yml/runs'):
+                user = path.split('/')[3].split('-')[1]
+                conclusion = {'alice': 'success', 'bob': 'failure'}.get(user)
+                if path.split('/')[3].startswith('hw10-'):
+                    conclusion = 'failure'
+                return httpx.Response(200, json={'total_count': 1, 'workflow_runs': [
+                    {'id': 1, 'conclusion': conclusion,
+                     'head_commit': {'timestamp': '2023-01-01T12:00:00Z'}}]})
+            if path.endswith('/enrollments'):
+                return httpx.Response(200, json=[
+                    {'user_id': 10, 'user': {'login_id': 'AB123'}},
+                    {'user_id': 11, 'user': {'login_id': 'cd456'}}])
+            if path.endswith('/assignments'):
+                return httpx.Response(200, json=[{'id': 5, 'name': 'hw1'}])
+            if path.endswith('/update_grades'):
+                posted.update(dict(httpx.QueryParams(request.content.decode())))
+                return httpx.Response(200, json={'id': 9, 'workflow_state': 'completed'})
+            return httpx.Response(404)
+
+        username_map = pd.DataFrame({'Github Username': ['alice', 'bob'],
+                                     'EID': ['ab123', 'cd456']})
+        result = asyncio.run(aio.grade_assignment(
+            'hw1', username_map.set_index('Github Username'), org='org',
+            github_token='gh', canvas_url='https://canvas.test', canvas_token='cv',
+            course_id=1, multiplier=github_canvas_grader.DuePolicy.from_args(
+                {'--due': True, '<DATE>': '2023-01-02', '<TIME>': '00:00:00',
+                 '<TIME_ZONE>': 'UTC', '<MULTIPLIER>': '1.5'}),
+            transport=httpx.MockTransport(handler)))
+
+        self.assertEqual(result['grades'], {10: 1.5, 11: 0})
+        self.assertEqual(result['failures'], {})
+        self.assertEqual(list(result['skipped']), ['hw1-carol'])
+        self.assertEqual(posted, {'grade_data[10][posted_grade]': '1.5',
+                                  'grade_data[11][posted_grade]': '0.0'})
+
+    def test_012_rerun_latest_workflow_outcomes(self):
+        """Test that re-runs report an outcome for every repo."""
+        runs = {'hw1-done': fake_run(1, 'success'), 'hw1-busy': fake_run(2, None)}
+        api = SimpleNamespace(actions=FakeActions(runs), recv_hdrs={})
+        scheduler = github_canvas_grader.RequestScheduler()
+
+        outcomes = {repo: github_canvas_grader.rerun_latest_workflow(
+                        api, repo, scheduler=scheduler)
+                    for repo in ['hw1-done', 'hw1-busy', 'hw1-none']}
+
+        self.assertEqual(outcomes['hw1-done'], 'rerun requested')
+        self.assertTrue(outcomes['hw1-busy'].startswith('failed'))
+        self.assertEqual(outcomes['hw1-none'], 'no workflow runs')
+        self.assertEqual(api.actions.reruns, [1])
+
+        # Only the assignment's own repos are re-run, not those of hw10
+        runs = {'hw1-alice': fake_run(3, 'success'), 'hw10-alice': fake_run(4, 'success')}
+        api = SimpleNamespace(actions=FakeActions(runs), repos=FakeRepos(list(runs)),
+                              recv_hdrs={})
+        outcomes = github_canvas_grader.rerun_all_workflows_for_assignment(api, 'org', 'hw1')
+        self.assertEqual(outcomes, {'hw1-alice': 'rerun requested'})
+        self.assertEqual(api.actions.reruns, [3])
+
+    def test_013_dry_run_rerun_benchmark(self):
+        """Test re-running an assignment against a recorded fixture."""
+        repos = [f'hw1-user{i}' for i in range(10)] + ['hw2-user0']
+        fixture = {'org': 'org', 'repos': repos,
+                   'runs': {repo: fake_run(i, 'success')
+                            for i, repo in enumerate(repos[:8])},
+                   'latency': {'default': 0.0}}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fixture_file = os.path.join(tmp, 'fixture.json')
+            with open(fixture_file, 'w') as f:
+                json.dump(fixture, f)
+            report = github_canvas_grader.benchmark_rerun(fixture_file, 'hw1',
+                                                          max_workers=4)
+            # The module also runs as the grader.py script, outside of the package
+            script = subprocess.run([sys.executable, github_canvas_grader.__file__, '-T', 'hw1',
+                                     f'--dry-run={fixture_file}'],
+                                    capture_output=True, text=True, cwd=tmp)
+
+        self.assertEqual(report['repos'], 10)
+        self.assertEqual(report['calls_by_endpoint'],
+                         {'list_for_org': 2, 'list_workflow_runs': 10,
+                          're_run_workflow': 8})
+        self.assertEqual(report['calls'], 20)
+        self.assertEqual(script.returncode, 0, script.stderr)
+        self.assertIn('Dry run: re-running 10 repos', script.stdout)
+
+        # Discovery latency is recorded per listing page, not for all three
+        from github_canvas_grader.replay import ReplayGhApi, record_fixture
+        source = ReplayGhApi({'org': 'org', 'repos': [f'hw1-user{i}' for i in range(250)],
+                              'latency': {'default': 0.0, 'list_for_org': 0.02}})
+        with tempfile.TemporaryDirectory() as tmp:
+            recorded = record_fixture(source, 'org', 'hw1', os.path.join(tmp, 'fixture.json'))
+        self.assertEqual(source.calls['list_for_org'], 3)
+        self.assertEqual(len(recorded['repos']), 250)
+        self.assertGreaterEqual(recorded['latency']['list_for_org'], 0.02)
+        self.assertLess(recorded['latency']['list_for_org'], 0.04)
+
+    def test_014_mock_server_rate_limits(self):
+        """Test that the scheduler waits out the mock server's Github rate limit."""
+        from ghapi.all import GhApi
+        from github_canvas_grader.mock_server import MockData
+
+        data = MockData(6)
+        with mock_class(data, github_rate_limit=3, github_reset_interval=1.0) as mocked:
+            api = GhApi(owner=data.org, token='mock', gh_host=mocked.server.url)
+            scheduler = github_canvas_grader.RequestScheduler(max_concurrency=2,
+                                                              github_reserve=0,
+                                                              backoff=0.1)
+            runs = github_canvas_grader.fetch_latest_workflow_runs(
+                api, data.repos, max_workers=2, scheduler=scheduler)
+
+        self.assertEqual(runs, data.runs)
+        self.assertEqual(mocked.server.calls['list_workflow_runs'], 6)
+
+    def test_015_mock_server_bulk_update(self):
+        """Test bulk grade uploads against the mock server's Canvas endpoints."""
+        from canvasapi import Canvas
+        from github_canvas_grader.mock_server import MockData
+
+        data = MockData(4)
+        with mock_class(data, max_per_page=2, job_duration=0.05) as mocked:
+            course = Canvas(mocked.server.url, 'mock').get_course(data.course_id)
+            roster = github_canvas_grader.RosterCache(course)
+            assignment = github_canvas_grader.AssignmentResolver(course).get_assignment('hw1')
+            grades = {roster.canvas_id_for(eid): 1.0 for eid in data.eids}
+            grades[9999] = 0.5
+            failures = github_canvas_grader.upload_grades_in_bulk(assignment, grades,
+                                                                  poll_interval=0.05)
+
+        self.assertEqual(list(failures), [9999])
+        self.assertEqual(len(data.grades), 4)
+        self.assertEqual(mocked.server.calls['list_enrollments'], 2)
+
+    def test_016_metrics(self):
+        """Test that Github and Canvas calls are recorded per endpoint."""
+        from canvasapi import Canvas
+        from github_canvas_grader.mock_server import MockData
+
+        data = MockData(3)
+        metrics = github_canvas_grader.Metrics()
+        with mock_class(data) as mocked:
+            api = github_canvas_grader.InstrumentedGhApi(owner=data.org, token='mock',
+                                                         gh_host=mocked.server.url,
+                                                         metrics=metrics)
+            with metrics.phase('fetch_workflow_runs'):
+                github_canvas_grader.fetch_latest_workflow_runs(api, data.repos + ['hw1-nobody'])
+            course = Canvas(mocked.server.url, 'mock').get_course(data.course_id)
+            metrics.install_canvas_hook(course)
+            course.get_user('eid1', 'sis_login_id')
+
+        summary = metrics.summary()
+        runs = summary['endpoints'][
+            'github GET /repos/mock-org/{repo}/actions/workflows/{workflow_id}/runs']
+        self.assertEqual((runs['calls'], runs['errors']), (4, 1))
+        self.assertGreater(runs['bytes'], 0)
+        self.assertLessEqual(runs['p50'], runs['p95'])
+        self.assertIn('canvas GET /api/v1/courses/:id/users/sis_login_id::login_id',
+                      summary['endpoints'])
+        self.assertEqual(summary['services']['github']['calls'], 4)
+        self.assertEqual(list(summary['phases']), ['fetch_workflow_runs'])
+
+    def test_017_score_runs(self):
+        """Test vectorized scoring of a table of workflow runs."""
+        import pandas as pd
+
+        runs = {'hw1-Alice': fake_run(1, 'success', '2023-02-03T16:41:02-06:00'),
+                'hw1-bob': fake_run(2, 'failure'),
+                'hw1-carol': fake_run(3, 'cancelled'),
+                'hw1-dave': None,
+                'hw1-eve': fake_run(5, 'success', '2023-02-04T12:00:00Z')}
+        username_map = pd.DataFrame({'Github Username': ['alice', 'bob', 'carol', 'dave'],
+                                     'EID': ['a1', 'b2', 'c3', 'd4']}
+                                    ).set_index('Github Username')
+        frame = github_canvas_grader.runs_to_frame(runs)
+        self.assertEqual(list(frame['github_username']),
+                         ['alice', 'bob', 'carol', 'dave', 'eve'])
+
+        due = pd.Timestamp('2023-02-04', tz='UTC')
+        scored = github_canvas_grader.score_runs(
+            frame, username_map, multiplier=lambda times: (times <= due) * 0.5 + 1.0)
+
+        self.assertEqual(scored['score'].tolist()[:2], [1.5, 0.0])
+        self.assertTrue(scored['score'].iloc[2:4].isna().all())
+        self.assertEqual(scored['score'].iloc[4], 1.0)
+        self.assertEqual(scored['eid'].tolist()[:4], ['a1', 'b2', 'c3', 'd4'])
+        self.assertTrue(pd.isna(scored['eid'].iloc[4]))
+
+    def test_017_grade_runs_without_run_id(self):
+        """Test grading a GraphQL status check rollup run, which has no id."""
+        import pandas as pd
+
+        repository = {'defaultBranchRef': {'target': {
+            'committedDate': '2023-01-01T12:00:00Z',
+            'statusCheckRollup': {'state': 'SUCCESS'},
+            'checkSuites': {'nodes': []}}}}
+        runs = {'hw1-alice': github_canvas_grader.graphql_latest_workflow_run(repository)}
+        username_map = pd.DataFrame({'Github Username': ['alice'], 'EID': ['abc123']}
+                                    ).set_index('Github Username')
+        roster = github_canvas_grader.RosterCache(FakeCourse(['hw1']))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            state = github_canvas_grader.GradeStateStore(os.path.join(tmp, 'state.sqlite'))
+            for _ in range(2):
+                assignment = FakeAssignment()
+                result = github_canvas_grader.grade_runs(runs, 'hw1', username_map, roster,
+                                                         assignment, state=state, bulk=True,
+                                                         verbose=False)
+                self.assertEqual(result, {'grades': {100: 1.0}, 'failures': {}})
+                self.assertEqual(len(assignment.calls), 1)
+            state.close()
+
+    def test_018_due_policy(self):
+        """Test that lateness is measured on the total elapsed time."""
+        import pandas as pd
+
+        args = {'--due': True, '<DATE>': '2023-02-03', '<TIME>': '23:59:59',
+                '<TIME_ZONE>': 'CST', '<MULTIPLIER>': '1.1'}
+        policy = github_canvas_grader.DuePolicy.from_args(args)
+
+        on_time = '2023-02-03T23:00:00-06:00'
+        days_late = '2023-02-06T20:00:00-06:00'
+        self.assertEqual(policy.multiplier_for(on_time), 1.1)
+        self.assertEqual(policy.multiplier_for(days_late), 1.0)
+        self.assertEqual(github_canvas_grader.score_multiplier(args, days_late), 1.0)
+
+        times = pd.to_datetime(pd.Series([on_time, days_late]), utc=True)
+        self.assertEqual(policy(times).tolist(), [1.1, 1.0])
+        epochs = [t.timestamp() for t in times]
+        self.assertEqual(policy(epochs).tolist(), [1.1, 1.0])
+        self.assertEqual(github_canvas_grader.DuePolicy.from_args({'--due': False})(times)
+                         .tolist(), [1.0, 1.0])
+
+    def test_019_late_policy(self):
+        """Test tiered deadlines, decay, grace windows and extensions."""
+        import pandas as pd
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'extensions.csv'), 'w') as f:
+                f.write('EID,Extension Days\nEXT1,2\n')
+            policy_file = os.path.join(tmp, 'policy.json')
+            with open(policy_file, 'w') as f:
+                json.dump({'time_zone': 'CST',
+                           'deadlines': [{'due': '2023-02-01 23:59:59', 'multiplier': 1.1},
+                                         {'due': '2023-02-03 23:59:59', 'multiplier': 1.0}],
+                           'daily_penalty': 0.25, 'floor': 0.5, 'cutoff_days': 5,
+                           'grace_minutes': 15, 'extensions': 'extensions.csv'}, f)
+            policy = github_canvas_grader.LatePolicy.from_file(policy_file)
+
+        commits = ['2023-02-01T23:00:00-06:00',   # first deadline
+                   '2023-02-02T00:10:00-06:00',   # within the grace window
+                   '2023-02-03T23:00:00-06:00',   # last deadline
+                   '2023-02-04T12:00:00-06:00',   # 1 day late
+                   '2023-02-06T12:00:00-06:00',   # 3 days late, floored
+                   '2023-02-10T12:00:00-06:00',   # past the cutoff
+                   '2023-02-05T12:00:00-06:00']   # on time with an extension
+        eids = ['a', 'a', 'a', 'a', 'a', 'a', 'ext1']
+        times = pd.to_datetime(pd.Series(commits), utc=True)
+
+        self.assertEqual(policy(times, eids=eids).tolist(),
+                         [1.1, 1.1, 1.0, 0.75, 0.5, 0.0, 1.0])
+        self.assertEqual(policy(times).tolist()[-1], 0.5)
+
+        scored = github_canvas_grader.score_runs(
+            github_canvas_grader.runs_to_frame({'hw1-ext': fake_run(1, 'success', commits[-1])}),
+            pd.DataFrame({'Github Username': ['ext'], 'EID': ['ext1']}
+                         ).set_index('Github Username'),
+            multiplier=policy)
+        self.assertEqual(scored['score'].tolist(), [1.0])
+
+    def test_020_username_map_sheet_cache(self):
+        """Test that an unchanged Google sheet is served from the pickle cache."""
+        class FakeGoogleClient:
+            def __init__(self):
+                self.modified_time = '2023-01-01T00:00:00Z'
+                self.searches = 0
+                self.fetches = 0
+
+            def list_spreadsheet_files(self, title):
+                self.searches += 1
+                return [{'id': 'key1', 'name': title, 'modifiedTime': self.modified_time}]
+
+            def get_file_drive_metadata(self, key):
+                return {'id': key, 'modifiedTime': self.modified_time}
+
+            def open_by_key(self, key):
+                self.fetches += 1
+                records = [{'Github Username': 'Alice', 'EID': 'A1'}]
+                return SimpleNamespace(sheet1=SimpleNamespace(get_all_records=lambda: records))
+
+        client = FakeGoogleClient()
+        creditials = github_canvas_grader.base64.b64encode(b'{}').decode('ascii')
+        with tempfile.TemporaryDirectory() as tmp, \
+             mock.patch('gspread.service_account_from_dict', return_value=client):
+            cache_file = os.path.join(tmp, 'username_map.pickle')
+            for _ in range(3):
+                username_map = github_canvas_grader.username_map_from_google_sheet(
+                    creditials, 'M101', cache_file=cache_file)
+            self.assertEqual((client.searches, client.fetches), (1, 1))
+
+            client.modified_time = '2023-01-02T00:00:00Z'
+            github_canvas_grader.username_map_from_google_sheet(creditials, 'M101',
+                                                                cache_file=cache_file)
+            self.assertEqual((client.searches, client.fetches), (1, 2))
+
+        self.assertEqual(username_map.eid_for('alice'), 'a1')
+
+    def test_021_username_map(self):
+        """Test that the username map reports duplicates and conflicts."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'username_map.csv')
+            with open(path, 'w') as f:
+                f.write('Github Username,EID\n'
+                        'Alice,AB123\n'
+                        'alice,ab123\n'
+                        'bob,cd456\n'
+                        'bob,ef789\n'
+                        'carol,gh000\n'
+                        'carol-alt,GH000\n'
+                        ',zz999\n')
+            username_map = github_canvas_grader.UsernameMap.from_csv(path)
+
+        self.assertEqual(username_map.eid_for('ALICE'), 'ab123')
+        self.assertEqual(username_map.duplicates, ['alice'])
+        self.assertEqual(username_map.conflicts, {'bob': {'cd456', 'ef789'}})
+        self.assertEqual(username_map.shared_eids, {'gh000': ['carol', 'carol-alt']})
+        self.assertEqual(len(username_map), 3)
+        with self.assertRaisesRegex(KeyError, 'conflicting'):
+            username_map.eid_for('bob')
+        with self.assertRaises(KeyError):
+            username_map.eid_for('dave')
+
+    def test_021_username_map_csv_encoding_and_columns(self):
+        """Test reading an Excel exported csv and rejecting missing columns."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'username_map.csv')
+            with open(path, 'w', encoding='utf-8-sig') as f:
+                f.write('Github Username,EID\nAlice,AB123\n')
+            self.assertEqual(github_canvas_grader.UsernameMap.from_csv(path).eid_for('alice'),
+                             'ab123')
+
+            with open(path, 'w') as f:
+                f.write('GitHub username,EID\nAlice,AB123\n')
+            with self.assertRaisesRegex(ValueError, 'Github Username'):
+                github_canvas_grader.UsernameMap.from_csv(path)
+
+    def test_022_import_time(self):
+        """Test that importing the grader stays within its import time budget."""
+        budget = float(os.environ.get('GRADER_IMPORT_BUDGET_MS', 150)) * 1000
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                 'import github_canvas_grader'],
+                                capture_output=True, text=True, check=True)
+
+        imported = dict()
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, cumulative, name = line[len('import time:'):].split('|')
+                if cumulative.strip().isdigit():
+                    imported[name.strip()] = int(cumulative)
+
+        heavy = {'pandas', 'numpy', 'gspread', 'canvasapi', 'ghapi', 'dateutil'}
+        self.assertEqual(heavy.intersection(imported), set())
+        self.assertLess(imported['github_canvas_grader'], budget)
+
+    def test_023_cli_grade_and_status(self):
+        """Test the grade and status subcommands against the mock server."""
+        from github_canvas_grader import cli
+        from github_canvas_grader.mock_server import MockData
+
+        data = MockData(5)
+        with mock_class(data) as mocked:
+            graded = cli.main(['grade', 'hw1', '--bulk', '--quiet',
+                               '--cache-dir', os.path.join(mocked.tmp, 'cache')])
+            shown = cli.main(['status', 'hw1'])
+
+            os.remove('username_map.csv')
+            with self.assertRaisesRegex(ValueError, 'username map'):
+                cli.main(['grade', 'hw1', '--quiet', '--no-cache'])
+
+        self.assertEqual((graded, shown), (0, 0))
+        self.assertIn('hw1: graded 5 of 5 repos, 0 failed', mocked.output.getvalue())
+        self.assertIn('hw1-student1: 1.0 (success', mocked.output.getvalue())
+        self.assertEqual(len(data.grades), 5)
+
+    def test_024_grade_several_assignments(self):
+        """Test grading several assignments and globs from one repo listing."""
+        from github_canvas_grader import cli
+        from github_canvas_grader.mock_server import MockData
+
+        self.assertEqual(github_canvas_grader.partition_repos(
+            ['hw1-a', 'hw10-a', 'hw2-b', 'lab1-c'], ['hw1', 'hw10', 'hw2']),
+            {'hw1': ['hw1-a'], 'hw10': ['hw10-a'], 'hw2': ['hw2-b']})
+
+        data = MockData(4, ['hw1', 'hw2', 'hw10'])
+        with mock_class(data) as mocked:
+            graded = cli.main(['grade', 'hw1', 'hw2*', '--bulk', '--quiet',
+                               '--cache-dir', os.path.join(mocked.tmp, 'cache')])
+            single = cli.main(['grade', 'hw1', '--quiet', '--no-cache'])
+            searched = cli.main(['grade', 'hw1', 'hw2', '--quiet', '--no-cache',
+                                 '--discovery', 'search'])
+
+        output, server = mocked.output.getvalue(), mocked.server
+        self.assertEqual((graded, single, searched), (0, 0, 0))
+        self.assertEqual(output.count('hw1: graded 4 of 4 repos, 0 failed'), 3)
+        self.assertEqual(output.count('hw2: graded 4 of 4 repos, 0 failed'), 2)
+        self.assertNotIn('hw10:', output)
+        # One page for the cached listing, two for the uncached one
+        self.assertEqual(server.calls['list_org_repos'], 3)
+        self.assertEqual(server.calls['search_repos'], 2)
+        # One listing per run, shared by all assignments of a run
+        self.assertEqual(server.calls['list_assignments'], 3)
+        self.assertEqual(server.calls['list_enrollments'], 3)
+        self.assertEqual(server.calls['update_grades'], 2)
+        self.assertEqual({assignment for assignment, _ in data.grades},
+                         {str(data.assignments['hw1']), str(data.assignments['hw2'])})
+
+    def test_024_expand_refreshes_stale_index(self):
+        """Test that globs see assignments created after the index was cached."""
+        with tempfile.TemporaryDirectory() as tmp:
+            index_file = os.path.join(tmp, 'assignments.json')
+            github_canvas_grader.AssignmentResolver(
+                FakeCourse(['hw1', 'hw2']), index_file).refresh()
+
+            course = FakeCourse(['hw1', 'hw2', 'hw3'])
+            resolver = github_canvas_grader.AssignmentResolver(course, index_file)
+            self.assertEqual(resolver.expand(['hw*', 'hw?', 'lab1']),
+                             ['hw1', 'hw2', 'hw3', 'lab1'])
+            self.assertEqual(course.listings, 1)
+
+    def test_025_webhook_server(self):
+        """Test grading replayed workflow_run webhooks against the mock server."""
+        from urllib.request import Request, urlopen
+
+        from github_canvas_grader import cli, webhook
+        from github_canvas_grader.mock_server import MockData
+
+        data = MockData(3, ['hw1', 'hw2'])
+        with mock_class(data, environ={'GRADER_WEBHOOK_SECRET': 'secret'}) as mocked:
+            # Keep the grade state to skip outdated runs
+            os.environ['GRADER_CACHE_DIR'] = mocked.tmp
+            webhook_grader = webhook.WebhookGrader(data.org, 'mock', data.course_id,
+                                                   canvas_url=mocked.server.url, verbose=False)
+
+            def urlopen_status(request):
+                try:
+                    with urlopen(request) as response:
+                        return response.status
+                except HTTPError as e:
+                    return e.code
+
+            def deliver(repo, run, secret='secret', event='workflow_run'):
+                return webhook.send_webhook(hook.url,
+                                            webhook.workflow_run_payload('mock-org', repo, run),
+                                            secret, event=event)
+
+            run = data.runs['hw1-student1']
+            with webhook.WebhookServer(webhook_grader, 'secret') as hook:
+                rejected = deliver('hw1-student1', run, secret='wrong')
+                oversized = urlopen_status(Request(
+                    hook.url, data=b'{}', method='POST',
+                    headers={'Content-Length': str(webhook.MAX_PAYLOAD_BYTES + 1)}))
+                pong = deliver('hw1-student1', run, event='ping')
+                graded = deliver('hw1-student1', run)
+                unchanged = deliver('hw1-student1', run)
+                outdated = deliver('hw1-student1', dict(run, id=run['id'] - 1))
+                ignored = deliver('lab1-student1', run)
+                replayed = cli.main(['replay', hook.url, '--repo', 'hw2-student2',
+                                     '--org', 'mock-org', '--run-id', '1'])
+
+        self.assertEqual(rejected[0], 401)
+        self.assertEqual(oversized, 413)
+        self.assertEqual(pong, (200, {'status': 'pong'}))
+        self.assertEqual(graded[1]['status'], 'graded')
+        self.assertEqual(graded[1]['assignment'], 'hw1')
+        self.assertEqual(list(graded[1]['grades'].values()), [1.0])
+        self.assertEqual(unchanged[1]['grades'], {})
+        self.assertEqual(outdated[1]['status'], 'outdated')
+        self.assertEqual(ignored[1]['status'], 'ignored')
+        self.assertEqual(replayed, 0)
+        self.assertIn('"assignment": "hw2"', mocked.output.getvalue())
+        self.assertEqual(len(data.grades), 2)
+        # The roster and assignments stay warm and no Github call is needed
+        self.assertEqual(mocked.server.calls['list_enrollments'], 1)
+        self.assertEqual(mocked.server.calls['list_assignments'], 1)
+        self.assertEqual(mocked.server.calls['list_workflow_runs'], 0)